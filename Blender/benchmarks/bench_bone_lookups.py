@@ -0,0 +1,130 @@
+# Times the name lookups of skeletons & bones, on a synthetic rig of 500 bones: finding parents while building the
+# skeleton, the bone index of each vertex group influence while skinning (boneIndexOfGroup in Mesh), & the skeleton of
+# each mesh.  'before' is scanning the lists by name; 'after' is Skeleton.bonesByName, the boneIndexOfGroup cache, &
+# JsonExporter.skeletonIndices.
+#
+#   python bench_bone_lookups.py [bones] [vertex loops]
+import stubs
+stubs.install()
+
+from babylon_js.armature import Skeleton
+from babylon_js.json_exporter import JsonExporter
+
+import random
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+GROUPS_PER_VERTEX = 4
+N_SKELETONS = 100
+N_MESHES = 1000
+#===============================================================================
+# what was done before the indexes
+def legacy_get_bone(boneName, bones):
+    for bone in bones:
+        if boneName == bone.name:
+            return bone
+
+    raise Exception('bone name "' + boneName + '" not found in skeleton')
+
+def legacy_get_skeletonIndex(exporter, name):
+    for idx, skeleton in enumerate(exporter.skeletons):
+        if skeleton.name == name:
+            return idx
+
+    return None
+#===============================================================================
+def make_rig(nBones):
+    # each bone has one of the 4 bones before it as parent, so parents are looked up from all over the list
+    poseBones = []
+    for idx in range(nBones):
+        poseBones.append(SimpleNamespace(name = 'bone.' + str(idx), parent = poseBones[idx // 4] if idx > 0 else None))
+
+    return poseBones
+
+def make_vertex_groups(nBones, nLoops):
+    # a few groups which are not bones, e.g. for modifiers
+    groupNames = ['bone.' + str(idx) for idx in range(nBones)] + ['not a bone.' + str(idx) for idx in range(8)]
+    rng = random.Random(nLoops)
+    loops = [[SimpleNamespace(group = rng.randrange(len(groupNames)), weight = 0.25) for n in range(GROUPS_PER_VERTEX)] for idx in range(nLoops)]
+    return [SimpleNamespace(name = name) for name in groupNames], loops
+
+def timed(func):
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+#===============================================================================
+def build_before(poseBones):
+    bones = []
+    for poseBone in poseBones:
+        parentIndex = legacy_get_bone(poseBone.parent.name, bones).index if poseBone.parent else -1
+        bones.append(SimpleNamespace(name = poseBone.name, index = len(bones), parentBoneIndex = parentIndex))
+
+    return bones
+
+def build_after(poseBones):
+    skeleton = SimpleNamespace(bones = [], bonesByName = {})
+    for poseBone in poseBones:
+        parentIndex = Skeleton.get_bone(poseBone.parent.name, skeleton.bonesByName).index if poseBone.parent else -1
+        bone = SimpleNamespace(name = poseBone.name, index = len(skeleton.bones), parentBoneIndex = parentIndex)
+        skeleton.bones.append(bone)
+        skeleton.bonesByName[bone.name] = bone
+
+    return skeleton
+
+def skin_before(bones, poseBones, vertexGroups, loops):
+    for groups in loops:
+        matricesIndices = []
+        for group in groups:
+            for bone in poseBones:
+                if vertexGroups[group.group].name == bone.name:
+                    matricesIndices.append(legacy_get_bone(bone.name, bones).index)
+
+def skin_after(skeleton, poseBonesByName, vertexGroups, loops):
+    boneIndexOfGroup = {}
+    for groups in loops:
+        matricesIndices = []
+        for group in groups:
+            index = group.group
+            if index not in boneIndexOfGroup:
+                groupName = vertexGroups[index].name
+                boneIndexOfGroup[index] = Skeleton.get_index_of_bone(skeleton, groupName) if groupName in poseBonesByName else None
+
+            boneIndex = boneIndexOfGroup[index]
+            if boneIndex is not None:
+                matricesIndices.append(boneIndex)
+
+def find_skeletons(getSkeletonIndex, exporter, names):
+    for name in names:
+        assert getSkeletonIndex(exporter, name) is not None
+#===============================================================================
+def main():
+    nBones = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nLoops = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    poseBones = make_rig(nBones)
+    poseBonesByName = {poseBone.name: poseBone for poseBone in poseBones} # bpy collections look up names natively
+    vertexGroups, loops = make_vertex_groups(nBones, nLoops)
+
+    bones = build_before(poseBones)
+    skeleton = build_after(poseBones)
+    assert [bone.parentBoneIndex for bone in bones] == [bone.parentBoneIndex for bone in skeleton.bones]
+
+    exporter = SimpleNamespace(skeletons = [], skeletonIndices = {})
+    for idx in range(N_SKELETONS):
+        JsonExporter.register_skeleton(exporter, SimpleNamespace(name = 'armature.' + str(idx)))
+
+    meshSkeletons = [exporter.skeletons[idx].name for idx in random.Random(N_MESHES).choices(range(N_SKELETONS), k = N_MESHES)]
+
+    rows = [('build skeleton, ' + str(nBones) + ' bones', timed(lambda: build_before(poseBones)), timed(lambda: build_after(poseBones))),
+            ('skin ' + str(nLoops) + ' loops x ' + str(GROUPS_PER_VERTEX) + ' groups', timed(lambda: skin_before(bones, poseBones, vertexGroups, loops)),
+                                                                                   timed(lambda: skin_after(skeleton, poseBonesByName, vertexGroups, loops))),
+            ('skeleton of ' + str(N_MESHES) + ' meshes, ' + str(N_SKELETONS) + ' skeletons', timed(lambda: find_skeletons(legacy_get_skeletonIndex, exporter, meshSkeletons)),
+                                                                                          timed(lambda: find_skeletons(JsonExporter.get_skeletonIndex, exporter, meshSkeletons)))]
+
+    print('%-40s  %10s  %10s' % ('', 'ms before', 'ms after'))
+    for label, before, after in rows:
+        print('%-40s  %10.2f  %10.2f' % (label, before * 1000, after * 1000))
+
+if __name__ == '__main__':
+    main()
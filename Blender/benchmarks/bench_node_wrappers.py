@@ -0,0 +1,121 @@
+# Times AbstractBJSNode.readNodeTree() on a chain of diamonds: each mix shader has both shader inputs linked to the
+# same node below it, so there are 2 ** depth paths from the output to the bottom node.  'before' is the dispatch of
+# the if / elif chain without a memo, so every path is wrapped again; 'after' is the current GetBJSWrapperNode().
+#
+#   python bench_node_wrappers.py [max depth]
+import stubs
+stubs.install()
+
+from babylon_js.materials.nodes.abstract import AbstractBJSNode
+
+import sys
+from time import perf_counter
+#===============================================================================
+# just what the wrapper constructors read of bpy nodes, sockets & links
+class StubSocket:
+    def __init__(self, name, identifier, link = None):
+        self.name = name
+        self.identifier = identifier
+        self.links = [link] if link is not None else []
+        self.default_value = 0.5
+
+class StubLink:
+    def __init__(self, fromNode):
+        self.from_node = fromNode
+        self.from_socket = fromNode.outputs[0]
+
+class StubNode:
+    def __init__(self, bl_idname, inputs):
+        self.bl_idname = bl_idname
+        self.inputs = inputs
+        self.outputs = [StubSocket('Shader', 'Shader')]
+        self.is_active_output = True
+
+    def as_pointer(self):
+        return id(self)
+
+class StubTree:
+    def __init__(self, nodes):
+        self.nodes = nodes
+#===============================================================================
+def make_diamond_tree(depth):
+    node = StubNode('ShaderNodeMixShader', [StubSocket('Fac', 'Fac')])
+    nodes = [node]
+    for level in range(depth):
+        node = StubNode('ShaderNodeMixShader', [StubSocket('Fac', 'Fac'), StubSocket('Shader', 'Shader', StubLink(node)), StubSocket('Shader', 'Shader_001', StubLink(node))])
+        nodes.append(node)
+
+    nodes.append(StubNode('ShaderNodeOutputMaterial', [StubSocket('Surface', 'Surface', StubLink(node))]))
+    return StubTree(nodes)
+#===============================================================================
+# GetBJSWrapperNode() before the memo: every sub-class imported, then compared in turn, on every call
+def legacy_get_wrapper_node(bpyNode, socketName, fromSocket = None):
+    from babylon_js.materials.nodes.ambient_occlusion import AmbientOcclusionBJSNode
+    from babylon_js.materials.nodes.background import BackgroundBJSNode
+    from babylon_js.materials.nodes.diffuse import DiffuseBJSNode
+    from babylon_js.materials.nodes.emission import EmissionBJSNode
+    from babylon_js.materials.nodes.fresnel import FresnelBJSNode
+    from babylon_js.materials.nodes.glossy import GlossyBJSNode
+    from babylon_js.materials.nodes.gltf import GltfBJSNode
+    from babylon_js.materials.nodes.mapping import MappingBJSNode
+    from babylon_js.materials.nodes.normal_map import NormalMapBJSNode
+    from babylon_js.materials.nodes.passthru import PassThruBJSNode
+    from babylon_js.materials.nodes.principled import PrincipledBJSNode
+    from babylon_js.materials.nodes.refraction import RefractionBJSNode
+    from babylon_js.materials.nodes.tex_coord import TextureCoordBJSNode
+    from babylon_js.materials.nodes.tex_environment import TextureEnvironmentBJSNode
+    from babylon_js.materials.nodes.tex_image import TextureImageBJSNode
+    from babylon_js.materials.nodes.transparency import TransparentBJSNode
+    from babylon_js.materials.nodes.uv_map import UVMapBJSNode
+    from babylon_js.materials.nodes.unsupported import UnsupportedNode
+
+    for wrapperClass in (AmbientOcclusionBJSNode, BackgroundBJSNode, DiffuseBJSNode, EmissionBJSNode, FresnelBJSNode,
+                         GlossyBJSNode, GltfBJSNode, MappingBJSNode, NormalMapBJSNode, PassThruBJSNode, PrincipledBJSNode,
+                         RefractionBJSNode, TextureCoordBJSNode, TextureEnvironmentBJSNode, TextureImageBJSNode,
+                         TransparentBJSNode, UVMapBJSNode):
+        if wrapperClass is PassThruBJSNode:
+            if bpyNode.bl_idname in PassThruBJSNode.PASS_THRU_SHADERS:
+                return wrapperClass(bpyNode, socketName)
+
+        elif wrapperClass.bpyType == bpyNode.bl_idname:
+            return wrapperClass(bpyNode, socketName)
+
+    return UnsupportedNode(bpyNode, socketName)
+#===============================================================================
+# returns (wrappers made, secs) of reading the tree, with the given GetBJSWrapperNode
+def time_read(tree, getWrapperNode):
+    nWraps = 0
+    originalInit = AbstractBJSNode.__init__
+    originalGet = AbstractBJSNode.__dict__['GetBJSWrapperNode']
+
+    def countingInit(self, *args, **kwargs):
+        nonlocal nWraps
+        nWraps += 1
+        originalInit(self, *args, **kwargs)
+
+    AbstractBJSNode.__init__ = countingInit
+    AbstractBJSNode.GetBJSWrapperNode = staticmethod(getWrapperNode)
+    try:
+        start = perf_counter()
+        AbstractBJSNode.readMaterialNodeTree(tree)
+        secs = perf_counter() - start
+    finally:
+        AbstractBJSNode.__init__ = originalInit
+        AbstractBJSNode.GetBJSWrapperNode = originalGet
+
+    return nWraps, secs
+#===============================================================================
+def main():
+    maxDepth = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    current = AbstractBJSNode.GetBJSWrapperNode
+    time_read(make_diamond_tree(1), legacy_get_wrapper_node) # first imports of the sub-classes not timed
+
+    print('depth  wraps before  wraps after  ms before  ms after')
+    for depth in range(2, maxDepth + 1, 2):
+        tree = make_diamond_tree(depth)
+        wrapsBefore, secsBefore = time_read(tree, legacy_get_wrapper_node)
+        wrapsAfter , secsAfter  = time_read(tree, current)
+        print('%5d  %12d  %11d  %9.2f  %8.2f' % (depth, wrapsBefore, wrapsAfter, secsBefore * 1000, secsAfter * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Times registering materials & meshes on the exporter, then looking them up by name, as meshes do for their
+# materials & cameras do for their locked targets.  'before' is appending to the lists & scanning them for each lookup;
+# 'after' is JsonExporter.register_material() / register_mesh_or_node() & the dicts they keep.
+#
+#   python bench_registries.py [counts of objects, e.g. 10000 100000]
+import stubs
+stubs.install()
+
+from babylon_js.json_exporter import JsonExporter
+
+import random
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+N_LOOKUPS = 1000
+#===============================================================================
+# what was done before the indexes
+def legacy_get_material(exporter, baseMaterialId):
+    for material in exporter.materials:
+        if material.name == baseMaterialId:
+            return material
+
+    return None
+
+def legacy_get_target(meshesAndNodes, lockedTargetId):
+    for mesh in meshesAndNodes:
+        if mesh.name == lockedTargetId:
+            return mesh
+
+    return None
+#===============================================================================
+def make_exporter():
+    return SimpleNamespace(materials = [], materialsByName = {}, meshesAndNodes = [], meshesAndNodesByName = {})
+
+def timed(func):
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+def run(nObjects):
+    objects = [SimpleNamespace(name = 'object.' + str(idx)) for idx in range(nObjects)]
+    names = [objects[idx].name for idx in random.Random(nObjects).choices(range(nObjects), k = N_LOOKUPS)]
+
+    # before
+    exporter = make_exporter()
+    def register():
+        for obj in objects:
+            exporter.materials.append(obj)
+            exporter.meshesAndNodes.append(obj)
+
+    def lookup():
+        for name in names:
+            assert legacy_get_material(exporter, name) is not None
+            assert legacy_get_target(exporter.meshesAndNodes, name) is not None
+
+    before = (timed(register), timed(lookup))
+
+    # after
+    exporter = make_exporter()
+    def register():
+        for obj in objects:
+            JsonExporter.register_material(exporter, obj)
+            JsonExporter.register_mesh_or_node(exporter, obj)
+
+    def lookup():
+        for name in names:
+            assert JsonExporter.getMaterial(exporter, name) is not None
+            assert exporter.meshesAndNodesByName.get(name) is not None
+
+    after = (timed(register), timed(lookup))
+    return before, after
+#===============================================================================
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 25000, 50000, 100000]
+
+    print('each object is registered as both a material & a mesh; ' + str(N_LOOKUPS) + ' lookups of each')
+    print('  objects  register ms before    after  lookups ms before     after')
+    for nObjects in counts:
+        (registerBefore, lookupBefore), (registerAfter, lookupAfter) = run(nObjects)
+        print('%9d  %18.2f  %7.2f  %17.2f  %8.3f' % (nObjects, registerBefore * 1000, registerAfter * 1000, lookupBefore * 1000, lookupAfter * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Lets modules of the add-on be imported outside of Blender, for timing the pure Python parts of an export.  bpy &
+# mathutils are replaced by permissive stand-ins, & babylon_js by an empty package, so its __init__.py, which registers
+# operators, is not run.  Nothing which really needs Blender can be timed this way.
+from ast import literal_eval
+from os import path
+import re
+import sys
+import types
+
+SRC_DIR = path.join(path.dirname(path.abspath(__file__)), '..', 'src')
+#===============================================================================
+class StubType(type):
+    def __getattr__(cls, name):
+        return Stub
+
+class Stub(metaclass = StubType):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Stub()
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __matmul__(self, other):
+        return Stub()
+
+    def __iter__(self):
+        return iter(())
+#===============================================================================
+def stub_module(name):
+    module = types.ModuleType(name)
+    module.__getattr__ = lambda attr: Stub
+    sys.modules[name] = module
+    return module
+
+def install():
+    if 'babylon_js' in sys.modules: return
+
+    bpy = stub_module('bpy')
+    bpy.app = types.SimpleNamespace(version = (2, 80, 0), version_string = '2.80 (stub)')
+    for name in ('bpy.types', 'bpy.props', 'bpy_extras', 'bpy_extras.io_utils', 'mathutils'):
+        stub_module(name)
+
+    package = types.ModuleType('babylon_js')
+    package.__path__ = [path.join(SRC_DIR, 'babylon_js')]
+    with open(path.join(package.__path__[0], '__init__.py'), encoding = 'utf8') as init:
+        package.bl_info = literal_eval(re.search(r'bl_info = (\{.*?\})', init.read(), re.DOTALL).group(1))
+    sys.modules['babylon_js'] = package
@@ -2,6 +2,10 @@ from .logging import *
 from .package_level import *
 
 import bpy
+from math import acos, sin
+from re import compile
+from mathutils import Matrix, Quaternion, Vector
+import numpy as np
 
 FRAME_BASED_ANIMATION = True # turn off for diagnostics; only actual keyframes will be written for skeleton animation
 
@@ -12,6 +16,14 @@ ANIMATIONTYPE_QUATERNION = 2
 ANIMATIONTYPE_MATRIX = 3
 #ANIMATIONTYPE_COLOR3 = 4
 
+# floats per key, stored as x, y, z (, w) for vectors & quaternions, and by row for matrices
+KEY_WIDTHS = {ANIMATIONTYPE_VECTOR3: 3, ANIMATIONTYPE_QUATERNION: 4, ANIMATIONTYPE_MATRIX: 16}
+
+# order written: x, z, y for vectors; x, z, y, -w for quaternions; by column for matrices (what format_matrix4 does)
+KEY_SWIZZLES = {ANIMATIONTYPE_VECTOR3   : [0, 2, 1],
+                ANIMATIONTYPE_QUATERNION: [0, 2, 1, 3],
+                ANIMATIONTYPE_MATRIX    : [0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15]}
+
 # passed to Animation constructor from animatable objects, defined in BABYLON.Animation
 #ANIMATIONLOOPMODE_RELATIVE = 0
 ANIMATIONLOOPMODE_CYCLE = 1
@@ -53,9 +65,7 @@ class AnimationRange:
         else:
             actionName = action.name
 
-        # assign the action to the object
-        object.animation_data.action = action
-
+        # the action is not assigned to the object here; AnimationScheduler does that when sampling
         if includeAllFrames:
             frame_start = int(action.frame_range[0])
             frame_end   = int(action.frame_range[1])
@@ -64,7 +74,7 @@ class AnimationRange:
         else:
             # capture built up from fcurves
             frames = dict()
-            for fcurve in object.animation_data.action.fcurves:
+            for fcurve in action.fcurves:
                 for key in fcurve.keyframe_points:
                     frame = key.co.x
                     frames[frame] = True
@@ -88,6 +98,9 @@ class AnimationRange:
 
 #===============================================================================
 class Animation:
+    __slots__ = ('dataType', 'framePerSecond', 'loopBehavior', 'name', 'propertyInBabylon', 'attrInBlender', 'mult', 'xOffset',
+                 'frames', 'values')
+
     def __init__(self, dataType, loopBehavior, name, propertyInBabylon, attrInBlender = None, mult = 1, xOffset = 0):
         self.dataType = dataType
         self.framePerSecond = bpy.context.scene.render.fps
@@ -100,52 +113,82 @@ class Animation:
         self.mult = mult
         self.xOffset = xOffset
 
-        #keys
-        self.frames = []
-        self.values = [] # vector3 for ANIMATIONTYPE_VECTOR3 & matrices for ANIMATIONTYPE_MATRIX
+        #keys, a row of values for each frame
+        self.frames = np.zeros(0)
+        self.values = np.zeros((0, KEY_WIDTHS[dataType]))
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    # a separate method outside of constructor, so can be called once for each Blender Action object participates in
-    def append_range(self, object, animationRange):
-        # action already assigned, always using poses, not every frame, build up again filtering by attrInBlender
-        for idx in range(len(animationRange.frames_in)):
-            bpy.context.scene.frame_set(animationRange.frames_in[idx])
-
-            self.frames.append(animationRange.frames_out[idx])
-            self.values.append(self.get_attr(object))
-
-        return len(animationRange.frames_in) > 0
+    # a separate method outside of constructor, so can be called once for each Blender Action object participates in.
+    # Frames are known now, values are placeholders until AnimationScheduler calls sample(); returns index of first key
+    def append_range(self, animationRange):
+        firstKey = len(self.frames)
+        nKeys = len(animationRange.frames_out)
+        self.frames = np.concatenate((self.frames, animationRange.frames_out))
+        self.values = np.concatenate((self.values, np.zeros((nKeys, self.values.shape[1]))))
+        return firstKey
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # called once the scene is at the frame of the key
+    def sample(self, object, keyIdx):
+        self.set_value(keyIdx, self.get_attr(object))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # alternative to sample(), without the scene needing to be at the frame
+    def evaluate(self, evaluator, keyIdx, frame):
+        self.set_value(keyIdx, self.from_blender(evaluator.evaluate(frame)))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def set_value(self, keyIdx, value):
+        if self.dataType == ANIMATIONTYPE_MATRIX:
+            self.values[keyIdx] = [v for row in value for v in row]
+        elif self.dataType == ANIMATIONTYPE_QUATERNION:
+            self.values[keyIdx] = (value.x, value.y, value.z, value.w)
+        else:
+            self.values[keyIdx] = (value[0], value[1], value[2])
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # the value of a key as a mathutils object, for when math is to be done on it
+    def get_value(self, keyIdx):
+        row = self.values[keyIdx]
+        if self.dataType == ANIMATIONTYPE_MATRIX:
+            return Matrix(row.reshape(4, 4).tolist())
+        elif self.dataType == ANIMATIONTYPE_QUATERNION:
+            return Quaternion((row[3], row[0], row[1], row[2]))
+        else:
+            return Vector(row)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_attr(self, object):
+        return self.from_blender(getattr(object, self.attrInBlender))
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # for auto animate
     def get_first_frame(self):
-        return self.frames[0] if len(self.frames) > 0 else -1
+        return self.frames[0].item() if len(self.frames) > 0 else -1
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # for auto animate
     def get_last_frame(self):
-        return self.frames[len(self.frames) - 1] if len(self.frames) > 0 else -1
+        return self.frames[len(self.frames) - 1].item() if len(self.frames) > 0 else -1
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_precision(self):
+        return bpy.context.scene.world.positionsPrecision if self.propertyInBabylon == 'position' else FLOAT_PRECISION_DEFAULT
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # values in the order written, converted from Blender to Babylon coordinates
+    def get_values_to_write(self):
+        values = self.values[:, KEY_SWIZZLES[self.dataType]]
+        if self.dataType == ANIMATIONTYPE_QUATERNION:
+            values[:, 3] *= -1
+
+        return values
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
-        precision = bpy.context.scene.world.positionsPrecision if self.propertyInBabylon == 'position' else FLOAT_PRECISION_DEFAULT
+        precision = self.get_precision()
         file_handler.write('{')
         write_int(file_handler, 'dataType', self.dataType, True)
         write_int(file_handler, 'framePerSecond', self.framePerSecond)
 
-        file_handler.write(',"keys":[')
-        first = True
-        for frame_idx in range(len(self.frames)):
-            if first != True:
-                file_handler.write(',')
-            first = False
-            file_handler.write('\n{')
-            write_int(file_handler, 'frame', self.frames[frame_idx], True)
-            value_idx = self.values[frame_idx]
-            if self.dataType == ANIMATIONTYPE_MATRIX:
-                write_matrix4(file_handler, 'values', value_idx)
-            elif self.dataType == ANIMATIONTYPE_QUATERNION:
-                write_quaternion(file_handler, 'values', value_idx)
-            else:
-                write_vector(file_handler, 'values', value_idx, precision)
-            file_handler.write('}')
+        # all keys are formatted at once, a column at a time; frames are written as format_int would
+        values = format_float_array(self.get_values_to_write(), precision)
+        keys = np.char.add(np.char.add('\n{"frame":', format_float_array(np.floor(self.frames))), ',"values":[')
+        for col in range(values.shape[1]):
+            keys = np.char.add(keys, values[:, col])
+            keys = np.char.add(keys, ',' if col < values.shape[1] - 1 else ']}')
 
+        file_handler.write(',"keys":[')
+        file_handler.write(','.join(keys.tolist()))
         file_handler.write(']')   # close keys
 
         # put this at the end to make less crazy looking ]}]]]}}}}}}}]]]],
@@ -156,24 +199,386 @@ class Animation:
         file_handler.write('}')
 #===============================================================================
 class VectorAnimation(Animation):
+    __slots__ = ()
+
     def __init__(self, object, propertyInBabylon, attrInBlender, mult = 1, xOffset = 0):
         super().__init__(ANIMATIONTYPE_VECTOR3, ANIMATIONLOOPMODE_CYCLE, propertyInBabylon + ' animation', propertyInBabylon, attrInBlender, mult, xOffset)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def get_attr(self, object):
-        return scale_vector(getattr(object, self.attrInBlender), self.mult, self.xOffset)
+    def from_blender(self, value):
+        return scale_vector(value, self.mult, self.xOffset)
 #===============================================================================
 class QuaternionAnimation(Animation):
+    __slots__ = ()
+
     def __init__(self, object, propertyInBabylon, attrInBlender, mult = 1, xOffset = 0):
         super().__init__(ANIMATIONTYPE_QUATERNION, ANIMATIONLOOPMODE_CYCLE, propertyInBabylon + ' animation', propertyInBabylon, attrInBlender, mult, xOffset)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def get_attr(self, object):
-        return post_rotate_quaternion(getattr(object, self.attrInBlender), self.xOffset)
+    def from_blender(self, value):
+        return post_rotate_quaternion(value, self.xOffset)
 #===============================================================================
 class QuaternionToEulerAnimation(Animation):
+    __slots__ = ()
+
     def __init__(self, propertyInBabylon, attrInBlender, mult = 1, xOffset = 0):
         super().__init__(ANIMATIONTYPE_VECTOR3, ANIMATIONLOOPMODE_CYCLE, propertyInBabylon + ' animation', propertyInBabylon, attrInBlender, mult, Offset)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def get_attr(self, object):
-        quat = getattr(object, self.attrInBlender)
+    def from_blender(self, quat):
         eul  = quat.to_euler("XYZ")
-        return scale_vector(eul, self.mult, self.xOffset)
\ No newline at end of file
+        return scale_vector(eul, self.mult, self.xOffset)
+#===============================================================================
+# A channel of a decomposed bone matrix.  Values come from a matrix already in Babylon coordinates, so are written as is.
+class BoneChannelAnimation(Animation):
+    __slots__ = ('precision',)
+
+    def __init__(self, dataType, propertyInBabylon, precision):
+        super().__init__(dataType, ANIMATIONLOOPMODE_CYCLE, propertyInBabylon + ' animation', propertyInBabylon)
+        self.precision = precision
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_precision(self):
+        return self.precision
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_values_to_write(self):
+        return self.values
+#===============================================================================
+# Removes keys which the runtime rebuilds within tolerance by interpolating between the keys kept; lerp for vectors,
+# slerp for quaternions, & lerp / slerp of the decomposed matrix for bones, when opted into.  First & last keys of each
+# range are kept.  Keys are compared as (nKeys, width) arrays, every key of a segment at once.
+class KeyframeReducer:
+    def __init__(self, world):
+        self.positionTolerance = world.positionTolerance
+        self.rotationTolerance = world.rotationTolerance
+        self.scalingTolerance  = world.scalingTolerance
+
+        # matrices are not interpolated unless BABYLON.Animation.AllowMatricesInterpolation is set, so bones would snap
+        self.reduceBoneMatrices = world.reduceBoneMatrices
+
+        self.nKeysIn  = 0
+        self.nKeysOut = 0
+        self.nAnimationsDropped = 0
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def reduce(self, animation, ranges):
+        nKeys = len(animation.frames)
+        self.nKeysIn += nKeys
+        frames = animation.frames
+        channels = self.getChannels(animation, animation.values)
+
+        keep = np.zeros(nKeys, dtype = bool)
+        for animationRange in ranges:
+            # keys of a range are contiguous, since ranges are appended in order
+            inRange = np.flatnonzero((frames >= animationRange.frame_start) & (frames <= animationRange.frame_end))
+            if len(inRange) == 0: continue
+
+            lo = inRange[0]
+            hi = inRange[-1]
+            keep[lo] = True
+            keep[hi] = True
+
+            # Douglas-Peucker, split at the worst key until every segment is within tolerance
+            segments = [(lo, hi)]
+            while len(segments) > 0:
+                lo, hi = segments.pop()
+                if hi - lo < 2: continue
+
+                t = (frames[lo + 1:hi] - frames[lo]) / (frames[hi] - frames[lo])
+                errors = np.zeros(hi - lo - 1)
+                for isQuaternion, values, tolerance in channels:
+                    interpolate = KeyframeReducer.slerp if isQuaternion else KeyframeReducer.lerp
+                    rebuilt = interpolate(values[lo], values[hi], t)
+                    errors = np.maximum(errors, KeyframeReducer.getErrors(isQuaternion, values[lo + 1:hi], rebuilt) / tolerance)
+
+                worstIdx = np.argmax(errors)
+                if errors[worstIdx] > 1: # errors are normalized to the tolerance
+                    worstIdx += lo + 1
+                    keep[worstIdx] = True
+                    segments.append((lo, worstIdx))
+                    segments.append((worstIdx, hi))
+
+        animation.frames = animation.frames[keep]
+        animation.values = animation.values[keep]
+        self.nKeysOut += len(animation.frames)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # when every key is within tolerance of the value exported without the animation, the animation is not needed
+    def isConstant(self, animation, staticValue):
+        if staticValue is None: return False
+
+        staticChannels = self.getChannels(animation, KeyframeReducer.toRow(animation.dataType, staticValue).reshape(1, -1))
+        for (isQuaternion, values, tolerance), (_, staticValues, _) in zip(self.getChannels(animation, animation.values), staticChannels):
+            if np.any(KeyframeReducer.getErrors(isQuaternion, values, staticValues) > tolerance):
+                return False
+
+        self.nAnimationsDropped += 1
+        return True
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def log_summary(self):
+        Logger.log('key frame reduction:  ' + str(self.nKeysIn) + ' keys in, ' + str(self.nKeysOut) + ' keys out, ' + str(self.nAnimationsDropped) + ' constant animations dropped', 1)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # what is interpolated, as a list of (is quaternion, (nKeys, width) array, tolerance); matrices are decomposed
+    def getChannels(self, animation, values):
+        if animation.dataType == ANIMATIONTYPE_MATRIX:
+            positions, rotations, scalings = KeyframeReducer.decompose(values)
+            return [(False, positions, self.getTolerance(self.positionTolerance)),
+                    (True , rotations, self.getTolerance(self.rotationTolerance)),
+                    (False, scalings , self.getTolerance(self.scalingTolerance))]
+
+        elif animation.dataType == ANIMATIONTYPE_QUATERNION:
+            return [(True, values, self.getTolerance(self.rotationTolerance))]
+
+        elif animation.propertyInBabylon == 'position':
+            tolerance = self.positionTolerance
+        elif animation.propertyInBabylon == 'scaling':
+            tolerance = self.scalingTolerance
+        else:
+            tolerance = self.rotationTolerance # euler angles, in radians
+
+        return [(False, values, self.getTolerance(tolerance))]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # a static value, e.g. a mathutils Vector, as a row of values as stored by Animation.set_value()
+    @staticmethod
+    def toRow(dataType, value):
+        if dataType == ANIMATIONTYPE_MATRIX:
+            return np.array([v for row in value for v in row])
+        elif dataType == ANIMATIONTYPE_QUATERNION:
+            return np.array((value.x, value.y, value.z, value.w))
+        else:
+            return np.array((value[0], value[1], value[2]))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # rows of 4x4 matrices, by row, to positions, x, y, z, w quaternions, & scalings; as Matrix.decompose() does, a
+    # negative determinant negates the scale
+    @staticmethod
+    def decompose(values):
+        matrices = values.reshape(-1, 4, 4)
+        positions = matrices[:, :3, 3]
+        basis = matrices[:, :3, :3]
+
+        scalings = np.linalg.norm(basis, axis = 1) # length of each column
+        scalings[np.linalg.det(basis) < 0] *= -1
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            rotations = KeyframeReducer.toQuaternions(np.nan_to_num(basis / scalings[:, np.newaxis, :]))
+
+        return positions, rotations, scalings
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # rotation matrices to x, y, z, w quaternions, each from the largest of the 4 components, so never dividing by ~0
+    @staticmethod
+    def toQuaternions(m):
+        m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+        cases = np.stack((m00 + m11 + m22, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11), axis = 1)
+        largest = np.argmax(cases, axis = 1)
+        s = 2 * np.sqrt(np.maximum(1 + cases[np.arange(len(m)), largest], 1e-12))
+
+        # columns are x, y, z, w
+        byCase = (np.stack((m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1], s * s / 4), axis = 1),
+                  np.stack((s * s / 4, m[:, 0, 1] + m[:, 1, 0], m[:, 0, 2] + m[:, 2, 0], m[:, 2, 1] - m[:, 1, 2]), axis = 1),
+                  np.stack((m[:, 0, 1] + m[:, 1, 0], s * s / 4, m[:, 1, 2] + m[:, 2, 1], m[:, 0, 2] - m[:, 2, 0]), axis = 1),
+                  np.stack((m[:, 0, 2] + m[:, 2, 0], m[:, 1, 2] + m[:, 2, 1], s * s / 4, m[:, 1, 0] - m[:, 0, 1]), axis = 1))
+
+        quaternions = np.choose(largest[:, np.newaxis], byCase) / s[:, np.newaxis]
+        return quaternions / np.linalg.norm(quaternions, axis = 1)[:, np.newaxis]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # largest difference of each row, the angle between rotations for quaternions, where q & -q are the same rotation
+    @staticmethod
+    def getErrors(isQuaternion, a, b):
+        if isQuaternion:
+            dot = np.abs(np.sum(a * b, axis = 1))
+            return 2 * np.arccos(np.minimum(dot, 1))
+
+        return np.max(np.abs(a - b), axis = 1)
+
+    @staticmethod
+    def getTolerance(tolerance):
+        return max(tolerance, 1e-9) # a 0 tolerance only removes exact duplicates
+
+    # rows between a & b, for each t
+    @staticmethod
+    def lerp(a, b, t):
+        return a + np.outer(t, b - a)
+
+    @staticmethod
+    def slerp(a, b, t):
+        dot = np.dot(a, b)
+        if dot < 0: # the shorter way around, as the runtime does
+            b = -b
+            dot = -dot
+
+        if dot > 0.999999:
+            rows = KeyframeReducer.lerp(a, b, t)
+            return rows / np.linalg.norm(rows, axis = 1)[:, np.newaxis]
+
+        theta = acos(dot)
+        return (np.outer(np.sin((1 - t) * theta), a) + np.outer(np.sin(t * theta), b)) / sin(theta)
+#===============================================================================
+# Evaluates the f-curves of one property (e.g. 'location') of an action directly, instead of setting the scene to the frame.
+# The transform properties sampled are only written by the animation system; parents & constraints only change the
+# world matrix.  So the result matches frame_set, when no drivers or active NLA tracks also write to those properties.
+class FCurveEvaluator:
+    def __init__(self, object, action, attrInBlender):
+        # channels without an f-curve keep their current value
+        self.restValue = getattr(object, attrInBlender).copy()
+        self.fcurves = [None] * len(self.restValue)
+
+        for fcurve in action.fcurves:
+            if fcurve.data_path != attrInBlender or fcurve.array_index >= len(self.fcurves): continue
+            if fcurve.mute or (fcurve.group is not None and fcurve.group.mute): continue
+
+            self.fcurves[fcurve.array_index] = fcurve
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def evaluate(self, frame):
+        value = self.restValue.copy()
+        for idx, fcurve in enumerate(self.fcurves):
+            if fcurve is not None:
+                value[idx] = fcurve.evaluate(frame)
+
+        return value
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def isExact(object, attrsInBlender):
+        animation_data = object.animation_data
+
+        # the action is not blended with anything
+        if animation_data.action_blend_type != 'REPLACE' or animation_data.action_influence != 1:
+            return False
+
+        if animation_data.use_nla:
+            for track in animation_data.nla_tracks:
+                if not track.mute: return False
+
+        for driver in animation_data.drivers:
+            if driver.data_path in attrsInBlender: return False
+
+        return True
+#===============================================================================
+# data_paths of an object's own transform, which is what is sampled
+TRANSFORM_PATHS = {'location', 'rotation_euler', 'rotation_quaternion', 'rotation_axis_angle', 'scale',
+                   'delta_location', 'delta_rotation_euler', 'delta_rotation_quaternion', 'delta_scale'}
+
+BONE_PATH = compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]')
+
+# Which actions can affect which object, so an object only gets a range for an action that can move it.  Built once
+# per export; an action applies when its name prefix (object-action) matches, & it has f-curves on the object's
+# transform, or on bones of the object when an armature.  The object's current action always applies.
+class ActionIndex:
+    instance = None
+
+    def __init__(self):
+        self.entries = [] # (action, name prefix or None, affects transform, bone names), in bpy.data.actions order
+        self.actionsOf = {} # key object name, value list of actions which apply
+
+        for action in bpy.data.actions:
+            # actions of materials, shape keys, etc, can never move an object
+            if action.id_root not in ('OBJECT', ''):
+                continue
+
+            prefix = action.name.partition('-')[0] if action.name.find('-') > 0 else None
+            affectsTransform = False
+            boneNames = set()
+            for fcurve in action.fcurves:
+                if fcurve.data_path in TRANSFORM_PATHS:
+                    affectsTransform = True
+                else:
+                    match = BONE_PATH.match(fcurve.data_path)
+                    if match is not None:
+                        boneNames.add(match.group(1).replace('\\"', '"').replace('\\\\', '\\'))
+
+            self.entries.append((action, prefix, affectsTransform, boneNames))
+
+        Logger.log('action index:  ' + str(len(self.entries)) + ' of ' + str(len(bpy.data.actions)) + ' actions for objects', 1)
+
+        # allow animatables to find their actions, without the exporter needing to be passed everywhere
+        ActionIndex.instance = self
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_actions(self, object):
+        actions = self.actionsOf.get(object.name)
+        if actions is not None:
+            return actions
+
+        currentAction = object.animation_data.action if object.animation_data else None
+        boneNames = set(object.pose.bones.keys()) if object.type == 'ARMATURE' else set()
+
+        actions = []
+        for action, prefix, affectsTransform, actionBoneNames in self.entries:
+            if prefix is not None and prefix != object.name:
+                continue
+
+            if action == currentAction or affectsTransform or not boneNames.isdisjoint(actionBoneNames):
+                actions.append(action)
+
+        self.actionsOf[object.name] = actions
+        return actions
+#===============================================================================
+# Sampling is requested by each animatable object, as (object, action, range, sampler), but done for all at once.
+# There is a pass per action, where only the objects sampling that action have it assigned;  every other object is at
+# its current action, so anything constrained, parented or driven is sampled against what it would be in the scene.
+# Requests of an object's current action share one pass, with the scene as it is.  frame_set is called once per
+# distinct frame of a pass, & every object & bone needing that frame is sampled before moving on.
+class AnimationScheduler:
+    instance = None
+
+    def __init__(self):
+        self.requests = {} # key object name, value list of requests in the order made
+        self.nRequests = 0
+        self.nFrameSets = 0
+
+        # allow animatables to make requests, without the exporter needing to be passed everywhere
+        AnimationScheduler.instance = self
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # sampler is called with the index of the frame in animationRange, once the scene is at that frame
+    def request(self, object, action, animationRange, sampler):
+        if object.name not in self.requests:
+            self.requests[object.name] = []
+
+        self.requests[object.name].append((object, action, animationRange, sampler))
+        self.nRequests += 1
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def run(self):
+        scene = bpy.context.scene
+        currentFrame = scene.frame_current
+
+        currentActions = []
+        passes = {} # key action name, or None for the current actions, value list of requests
+        for objectRequests in self.requests.values():
+            object = objectRequests[0][0]
+            currentAction = object.animation_data.action
+            currentActions.append((object, currentAction))
+
+            for request in objectRequests:
+                action = request[1]
+                key = None if action == currentAction else action.name
+                if key not in passes:
+                    passes[key] = []
+                passes[key].append(request)
+
+        # the scene as it is first, since that needs no action to be assigned
+        passKeys = sorted(passes, key = lambda key: key is not None)
+        for passKey in passKeys:
+            # every object back to its current action, before the ones sampled in this pass get theirs
+            for object, action in currentActions:
+                if object.animation_data.action != action:
+                    object.animation_data.action = action
+
+            # group by frame what to sample
+            samplersByFrame = {}
+            for object, action, animationRange, sampler in passes[passKey]:
+                if object.animation_data.action != action:
+                    object.animation_data.action = action
+
+                for idx, frame in enumerate(animationRange.frames_in):
+                    if frame not in samplersByFrame:
+                        samplersByFrame[frame] = []
+                    samplersByFrame[frame].append((sampler, idx))
+
+            # frames in ascending order, so each object is sampled in the same order as its range
+            for frame in sorted(samplersByFrame):
+                scene.frame_set(frame)
+                self.nFrameSets += 1
+
+                for sampler, idx in samplersByFrame[frame]:
+                    sampler(idx)
+
+        for object, action in currentActions:
+            object.animation_data.action = action
+
+        scene.frame_set(currentFrame)
+        self.nFrameSets += 1
+
+        Logger.log('animation sampling:  ' + str(self.nRequests) + ' requests from ' + str(len(self.requests)) + ' objects, in ' + str(len(passKeys)) + ' passes, ' + str(self.nFrameSets) + ' frame_set calls', 1)
+        self.requests = {}
+        AnimationScheduler.instance = None
@@ -3,10 +3,18 @@ from .logging import *
 from .package_level import *
 
 import bpy
+from io import StringIO
 from math import radians
 from mathutils import Vector, Matrix
+import numpy as np
 
 DEFAULT_LIB_NAME = 'Same as filename'
+
+# Blender Z up to Babylon Y up, with the handedness switch
+SYSTEM_MATRIX = Matrix.Scale(-1, 4, Vector((0, 0, 1))) @ Matrix.Rotation(radians(-90), 4, 'X')
+
+# the channels of a decomposed bone matrix, in the order of Matrix.decompose()
+BONE_CHANNELS = (('position', ANIMATIONTYPE_VECTOR3), ('rotationQuaternion', ANIMATIONTYPE_QUATERNION), ('scaling', ANIMATIONTYPE_VECTOR3))
 #===============================================================================
 class Bone:
     def __init__(self, bpyBone, bpySkeleton, bonesSoFar):
@@ -14,44 +22,86 @@ class Bone:
         Logger.log('processing begun of bone:  ' + bpyBone.name + ', index:  '+ str(self.index), 2)
         self.name = bpyBone.name
         self.length = bpyBone.length
-        self.posedBone = bpyBone # record so can be used by get_matrix, called by append_animation_pose
+        self.posedBone = bpyBone # record so can be used by get_matrix
         self.parentBone = bpyBone.parent
 
         self.matrix_world = bpySkeleton.matrix_world
         self.matrix = self.get_bone_matrix()
 
-        self.parentBoneIndex = Skeleton.get_bone(bpyBone.parent.name, bonesSoFar).index if bpyBone.parent else -1
+        self.parentBoneIndex = Skeleton.get_bone(bpyBone.parent.name, bonesSoFar).index if bpyBone.parent else -1 # bonesSoFar is by name
 
         #animation
         if (bpySkeleton.animation_data):
             self.animation = Animation(ANIMATIONTYPE_MATRIX, ANIMATIONLOOPMODE_CYCLE, 'anim', '_matrix')
-            self.previousBoneMatrix = None
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def append_animation_pose(self, frame, force = False):
-        currentBoneMatrix = self.get_bone_matrix()
+    # replaces the matrix animation with a transform node, which has an animation for each channel in BONE_CHANNELS.
+    # A track which never leaves the value in .matrix is dropped, except rotation & scaling of a mirrored bone, where
+    # decompose() is not unique.  When every track is dropped, the bone does not move, so gets no node
+    def decompose_animation(self, nodeId, precisions, ranges):
+        matrixAnimation = self.animation
+        del self.animation
+
+        nKeys = len(matrixAnimation.frames)
+        matrices = matrixAnimation.values.reshape(nKeys, 4, 4)
+        positiveDeterminant = self.matrix.determinant() > 0 and bool(np.all(np.linalg.det(matrices) > 0))
+
+        decomposed = [matrixAnimation.get_value(idx).decompose() for idx in range(nKeys)]
+        rows = [np.array([tuple(loc) for loc, rot, scale in decomposed]).reshape(nKeys, 3),
+                np.array([(rot.x, rot.y, rot.z, rot.w) for loc, rot, scale in decomposed]).reshape(nKeys, 4),
+                np.array([tuple(scale) for loc, rot, scale in decomposed]).reshape(nKeys, 3)]
+
+        # keep consecutive quaternions in the same hemisphere
+        rotations = rows[1]
+        for idx in range(1, nKeys):
+            if np.dot(rotations[idx], rotations[idx - 1]) < 0:
+                rotations[idx] *= -1
+
+        node = BoneTransformNode(nodeId, self.matrix, precisions, positiveDeterminant, ranges)
+        for channelIdx, (propertyInBabylon, dataType) in enumerate(BONE_CHANNELS):
+            precision = precisions[channelIdx]
+            values = rows[channelIdx]
+
+            if node.canDrop(propertyInBabylon):
+                restRow = node.restRows[channelIdx]
+                difference = np.abs(values - restRow)
+                if dataType == ANIMATIONTYPE_QUATERNION:
+                    difference = np.minimum(difference, np.abs(values + restRow)) # q & -q are the same rotation
+
+                if np.all(difference <= 0.5 * 10 ** -precision):
+                    continue
+
+            animation = BoneChannelAnimation(dataType, propertyInBabylon, precision)
+            animation.frames = matrixAnimation.frames
+            animation.values = values
+            node.animations.append(animation)
 
-        if (force or not same_matrix4(currentBoneMatrix, self.previousBoneMatrix)):
-            self.animation.frames.append(frame)
-            self.animation.values.append(currentBoneMatrix)
-            self.previousBoneMatrix = currentBoneMatrix
+        if len(node.animations) > 0:
+            self.transformNode = node
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def set_rest_pose(self, editBone):
-        self.rest = Bone.get_matrix(editBone, self.matrix_world)
+    # bpyBone is from armature.data.bones, where the rest pose is available without being in edit mode
+    def set_rest_pose(self, bpyBone):
+        self.rest = Bone.get_rest_matrix(bpyBone, self.matrix_world)
         # used to calc skeleton restDimensions
-        self.restHead = editBone.head
-        self.restTail = editBone.tail
+        self.restHead = bpyBone.head_local.copy()
+        self.restTail = bpyBone.tail_local.copy()
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def get_bone_matrix(self):
         return Bone.get_matrix(self.posedBone, self.matrix_world)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     @staticmethod
     def get_matrix(bpyBone, matrix_world):
-        SystemMatrix = Matrix.Scale(-1, 4, Vector((0, 0, 1))) @ Matrix.Rotation(radians(-90), 4, 'X')
+        if bpyBone.parent:
+            return (SYSTEM_MATRIX @ matrix_world @ bpyBone.parent.matrix).inverted() @ (SYSTEM_MATRIX @ matrix_world @ bpyBone.matrix)
+        else:
+            return SYSTEM_MATRIX @ matrix_world @ bpyBone.matrix
 
+    # same as get_matrix() with an edit bone, but .matrix_local of a Bone is what .matrix of an EditBone is
+    @staticmethod
+    def get_rest_matrix(bpyBone, matrix_world):
         if bpyBone.parent:
-            return (SystemMatrix @ matrix_world @ bpyBone.parent.matrix).inverted() @ (SystemMatrix @ matrix_world @ bpyBone.matrix)
+            return (SYSTEM_MATRIX @ matrix_world @ bpyBone.parent.matrix_local).inverted() @ (SYSTEM_MATRIX @ matrix_world @ bpyBone.matrix_local)
         else:
-            return SystemMatrix @ matrix_world @ bpyBone.matrix
+            return SYSTEM_MATRIX @ matrix_world @ bpyBone.matrix_local
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
         file_handler.write('\n{')
@@ -62,6 +112,9 @@ class Bone:
         write_int(file_handler, 'parentBoneIndex', self.parentBoneIndex)
         write_float(file_handler, 'length', self.length)
 
+        if hasattr(self, 'transformNode'):
+            write_string(file_handler, 'linkedTransformNodeId', self.transformNode.id)
+
         #animation
         if hasattr(self, 'animation'):
             file_handler.write('\n,"animation":')
@@ -69,56 +122,239 @@ class Bone:
 
         file_handler.write('}')
 #===============================================================================
+# The position, rotationQuaternion, & scaling tracks of a bone.  The loader links the bone to the node by the bone's
+# linkedTransformNodeId, then Skeleton.prepare() copies the local transform of the node into the bone every frame.
+# Values are from a matrix already in Babylon coordinates, so are written as is.
+class BoneTransformNode:
+    def __init__(self, id, matrix, precisions, positiveDeterminant, ranges):
+        self.id = id
+        self.precisions = precisions
+        self.positiveDeterminant = positiveDeterminant
+        self.ranges = ranges
+        self.animations = []
+
+        # the values when not animated, as mathutils objects for the reducer, & as rows in the order written
+        loc, rot, scale = matrix.decompose()
+        self.restValues = dict(zip([channel[0] for channel in BONE_CHANNELS], (loc, rot, scale)))
+        self.restRows = [np.array(tuple(loc)), np.array((rot.x, rot.y, rot.z, rot.w)), np.array(tuple(scale))]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def canDrop(self, propertyInBabylon):
+        return propertyInBabylon == 'position' or self.positiveDeterminant
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def reduce_animations(self, reducer):
+        kept = []
+        for animation in self.animations:
+            reducer.reduce(animation, self.ranges)
+            if not (self.canDrop(animation.propertyInBabylon) and reducer.isConstant(animation, self.restValues[animation.propertyInBabylon])):
+                kept.append(animation)
+
+        self.animations = kept
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def to_json_file(self, file_handler):
+        file_handler.write('\n{')
+        write_string(file_handler, 'name', self.id, True)
+        write_string(file_handler, 'id', self.id)
+        for channelIdx, (propertyInBabylon, dataType) in enumerate(BONE_CHANNELS):
+            values = format_float_array(self.restRows[channelIdx], self.precisions[channelIdx])
+            file_handler.write(',"' + propertyInBabylon + '":[' + ','.join(values.tolist()) + ']')
+
+        file_handler.write('\n,"animations":[')
+        first = True
+        for animation in self.animations:
+            if first != True:
+                file_handler.write(',')
+            first = False
+
+            animation.to_json_file(file_handler)
+
+        file_handler.write(']')
+
+        file_handler.write(',"ranges":[')
+        first = True
+        for range in self.ranges:
+            if first != True:
+                file_handler.write(',')
+            first = False
+
+            range.to_json_file(file_handler)
+
+        file_handler.write(']}')
+#===============================================================================
+# Samples the local matrices of every bone of a skeleton at once, with stacked 4x4 operations.  Keys are rows of a
+# (frames, bones, 16) array, filled in any order as the scheduler sets frames.
+class SkeletonSampler:
+    def __init__(self, bpySkeleton, bones, ranges):
+        self.bpySkeleton = bpySkeleton
+        poseBones = bpySkeleton.pose.bones
+
+        # parents are read from all pose bones, since skipped IK bones can still be parents
+        indexOf = {poseBone.name: idx for idx, poseBone in enumerate(poseBones)}
+        self.nPoseBones = len(poseBones)
+        self.boneIndices = np.array([indexOf[bone.name] for bone in bones], dtype = np.intp)
+        parentIndices = [indexOf[bone.parentBone.name] if bone.parentBone else -1 for bone in bones]
+        self.childRows   = np.array([row for row, parentIdx in enumerate(parentIndices) if parentIdx != -1], dtype = np.intp)
+        self.parentBones = np.array([parentIdx for parentIdx in parentIndices if parentIdx != -1], dtype = np.intp)
+
+        self.ranges = ranges
+        self.rangeOffsets = []
+        nFrames = 0
+        for animationRange in ranges:
+            self.rangeOffsets.append(nFrames)
+            nFrames += len(animationRange.frames_in)
+
+        self.frames = np.zeros(nFrames, dtype = np.int32)
+        self.firstOrLast = np.zeros(nFrames, dtype = bool)
+        self.keys = np.zeros((nFrames, len(bones), 16), dtype = np.float32)
+        self.poseBuffer = np.zeros(self.nPoseBones * 16, dtype = np.float32)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_range_sampler(self, rangeIdx):
+        animationRange = self.ranges[rangeIdx]
+        offset = self.rangeOffsets[rangeIdx]
+        nFrames = len(animationRange.frames_in)
+        self.firstOrLast[offset] = True
+        self.firstOrLast[offset + nFrames - 1] = True
+        def sampler(idx):
+            self.frames[offset + idx] = animationRange.frames_out[idx]
+            self.sample(offset + idx)
+
+        return sampler
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def sample(self, row):
+        # one read of every pose matrix; the raw data is column major
+        self.bpySkeleton.pose.bones.foreach_get('matrix', self.poseBuffer)
+        poseMatrices = self.poseBuffer.reshape(self.nPoseBones, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+        toBabylon = np.array(SYSTEM_MATRIX @ self.bpySkeleton.matrix_world)
+        world = np.matmul(toBabylon, poseMatrices[self.boneIndices])
+
+        local = world.copy()
+        if len(self.childRows) > 0:
+            parentWorld = np.matmul(toBabylon, poseMatrices[self.parentBones])
+            local[self.childRows] = np.matmul(np.linalg.inv(parentWorld), world[self.childRows])
+
+        self.keys[row] = local.reshape(-1, 16)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # a key is kept when it differs from the last key kept for the bone by more than can be written, or starts / ends
+    # a range.  Matrices are not interpolated by default, so comparing with only the frame before would let slow
+    # movement drift without ever being keyed.  Frames are walked in order, all bones of a frame at once.
+    def to_bone_animations(self, bones, keepAll, precision = FLOAT_PRECISION_DEFAULT):
+        nFrames = len(self.frames)
+        if keepAll:
+            keep = np.ones((nFrames, len(bones)), dtype = bool)
+        else:
+            tolerance = 0.5 * 10 ** -precision
+            keep = np.zeros((nFrames, len(bones)), dtype = bool)
+            if nFrames > 0:
+                keep[0] = True
+                lastKept = self.keys[0].copy()
+                for row in range(1, nFrames):
+                    changed = np.any(np.abs(self.keys[row] - lastKept) > tolerance, axis = 1)
+                    if self.firstOrLast[row]:
+                        changed[:] = True
+
+                    keep[row] = changed
+                    lastKept[changed] = self.keys[row, changed]
+
+        for boneIdx, bone in enumerate(bones):
+            rows = np.flatnonzero(keep[:, boneIdx])
+            bone.animation.frames = self.frames[rows].astype(np.float64)
+            bone.animation.values = self.keys[rows, boneIdx].astype(np.float64)
+#===============================================================================
 class Skeleton:
-    def __init__(self, bpySkeleton, context, id, ignoreIKBones):
+    def __init__(self, bpySkeleton, id, ignoreIKBones):
         Logger.log('processing begun of skeleton:  ' + bpySkeleton.name + ', id:  '+ str(id))
         self.name = bpySkeleton.name
         self.id = id
         self.bones = []
+        self.bonesByName = {} # kept in sync with self.bones
 
         for bone in bpySkeleton.pose.bones:
             if ignoreIKBones and Skeleton.isIkName(bone.name):
                 Logger.log('Ignoring IK bone:  ' + bone.name, 2)
                 continue
 
-            self.bones.append(Bone(bone, bpySkeleton, self.bones))
+            bone = Bone(bone, bpySkeleton, self.bonesByName)
+            self.bones.append(bone)
+            self.bonesByName[bone.name] = bone
 
         if (bpySkeleton.animation_data):
             self.ranges = []
+            actions = []
             frameOffset = 0
-            for action in bpy.data.actions:
-                # get the range / assigning the action to the object
+            applicableActions = ActionIndex.instance.get_actions(bpySkeleton)
+            Logger.log(str(len(applicableActions)) + ' of ' + str(len(bpy.data.actions)) + ' actions can affect skeleton', 2)
+            for action in applicableActions:
+                # get the range, sampled when the scheduler runs
                 animationRange = AnimationRange.actionPrep(bpySkeleton, action, FRAME_BASED_ANIMATION, frameOffset)
                 if animationRange is None:
                     continue
 
                 Logger.log('processing action ' + animationRange.to_string(), 2)
                 self.ranges.append(animationRange)
-
-                nFrames = len(animationRange.frames_in)
-                for idx in range(nFrames):
-                    bpy.context.scene.frame_set(animationRange.frames_in[idx])
-                    firstOrLast = idx == 0 or idx == nFrames - 1
-
-                    for bone in self.bones:
-                        bone.append_animation_pose(animationRange.frames_out[idx], firstOrLast)
+                actions.append(action)
 
                 frameOffset = animationRange.frame_end
 
-        # mode_set's only work when there is an active object, switch bones to edit mode to rest position
-        context.view_layer.objects.active = bpySkeleton
-        bpy.ops.object.mode_set(mode='EDIT')
+            # all ranges need to be known first, so the sampler can allocate the rows for every key
+            self.sampler = SkeletonSampler(bpySkeleton, self.bones, self.ranges)
+            for rangeIdx, animationRange in enumerate(self.ranges):
+                AnimationScheduler.instance.request(bpySkeleton, actions[rangeIdx], animationRange, self.sampler.get_range_sampler(rangeIdx))
 
-        # you need to access edit_bones from skeleton.data not skeleton.pose when in edit mode
-        for editBone in bpySkeleton.data.edit_bones:
-            for myBoneObj in self.bones:
-                if editBone.name == myBoneObj.name:
-                    myBoneObj.set_rest_pose(editBone)
-                    break
+        # rest pose from skeleton.data.bones, so no switch to edit mode
+        for myBoneObj in self.bones:
+            myBoneObj.set_rest_pose(bpySkeleton.data.bones[myBoneObj.name])
 
         self.dimensions = self.getDimensions()
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # called once the scheduler has run, to turn the sampled rows into bone keys
+    def collect_animations(self):
+        if not hasattr(self, 'sampler'): return
+
+        # tracks of transform nodes are interpolated, so a key held can only be removed once decomposed, not before
+        world = bpy.context.scene.world
+        self.sampler.to_bone_animations(self.bones, (world.reduceKeyframes and world.reduceBoneMatrices) or world.boneAnimationTRS)
+        del self.sampler
+
+        if world.boneAnimationTRS:
+            precisions = (world.bonePositionPrecision, world.boneRotationPrecision, world.boneScalingPrecision)
+            matrixBytes = 0
+            trsBytes = 0
+            nNodes = 0
+            nTracks = 0
+            for bone in self.bones:
+                matrixBytes += Skeleton.get_json_size(bone.animation)
+                bone.decompose_animation(self.name + ':' + bone.name, precisions, self.ranges)
+                if hasattr(bone, 'transformNode'):
+                    trsBytes += Skeleton.get_json_size(bone.transformNode)
+                    nNodes += 1
+                    nTracks += len(bone.transformNode.animations)
+
+            Logger.log('bone animations as TRS, ' + str(nTracks) + ' tracks on ' + str(nNodes) + ' transform nodes for ' + str(len(self.bones)) + ' bones:  ' + str(matrixBytes) + ' bytes as matrices, ' + str(trsBytes) + ' bytes as TRS, delta ' + str(trsBytes - matrixBytes), 1)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def get_json_size(writable):
+        buffer = StringIO()
+        writable.to_json_file(buffer)
+        return len(buffer.getvalue())
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # called once keys have been sampled; bones without any movement are exported with only their matrix.  Keys of
+    # matrices are only removed when opted into, since the runtime does not interpolate them by default
+    def reduce_animations(self, reducer):
+        if not hasattr(self, 'ranges'): return
+
+        for bone in self.bones:
+            if hasattr(bone, 'transformNode'):
+                bone.transformNode.reduce_animations(reducer)
+                if len(bone.transformNode.animations) == 0:
+                    del bone.transformNode
+
+            elif hasattr(bone, 'animation'):
+                if reducer.reduceBoneMatrices:
+                    reducer.reduce(bone.animation, self.ranges)
+
+                if reducer.isConstant(bone.animation, bone.matrix):
+                    del bone.animation
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # do not use .dimensions from blender, it might be including IK bones
     def getDimensions(self):
@@ -150,16 +386,19 @@ class Skeleton:
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # Since IK bones could be being skipped, looking up index of bone in second pass of mesh required
     def get_index_of_bone(self, boneName):
-        return Skeleton.get_bone(boneName, self.bones).index
+        return Skeleton.get_bone(boneName, self.bonesByName).index
 
     @staticmethod
-    def get_bone(boneName, bones):
-        for bone in bones:
-            if boneName == bone.name:
-                return bone
+    def get_bone(boneName, bonesByName):
+        bone = bonesByName.get(boneName)
+        if bone is not None:
+            return bone
 
         # should not happen, but if it does clearly a bug, so terminate
         raise Exception('bone name "' + boneName + '" not found in skeleton')
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_transform_nodes(self):
+        return [bone.transformNode for bone in self.bones if hasattr(bone, 'transformNode')]
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
         file_handler.write('{')
@@ -65,16 +65,12 @@ class Camera(FCurveAnimatable):
                 Logger.warn('Camera type with mandatory target specified, but no target to track set.  Ignored', 2)
                 self.fatalProblem = True
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def update_for_target_attributes(self, meshesAndNodes):
+    def update_for_target_attributes(self, meshesAndNodesByName):
         if not hasattr(self, 'lockedTargetId'): return
 
         # find the actual mesh tracking, so properties can be derrived
-        targetFound = False
-        for mesh in meshesAndNodes:
-            if mesh.name == self.lockedTargetId:
-                targetMesh = mesh
-                targetFound = True
-                break;
+        targetMesh = meshesAndNodesByName.get(self.lockedTargetId)
+        targetFound = targetMesh is not None
 
         xApart = 3 if not targetFound else self.position.x - targetMesh.position.x
         yApart = 3 if not targetFound else self.position.y - targetMesh.position.y
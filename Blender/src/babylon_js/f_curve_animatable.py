@@ -5,6 +5,9 @@ from .package_level import *
 import bpy
 #===============================================================================
 class FCurveAnimatable:
+    # sub-classes without __slots__ still get a __dict__, so this only limits those which also declare them
+    __slots__ = ('animationsPresent', 'animations', 'ranges', 'autoAnimate', 'autoAnimateFrom', 'autoAnimateTo', 'autoAnimateLoop')
+
     def define_animations(self, object, supportsRotation, supportsPosition, supportsScaling, xOffsetForRotation = 0):
         currentActionOnly = bpy.context.scene.world.currentActionOnly
         sceneLevelAutoAnimate = bpy.context.scene.world.autoAnimate
@@ -34,34 +37,51 @@ class FCurveAnimatable:
             self.ranges = []
             frameOffset = 0
 
+            # when exact, keys come straight from the f-curves, otherwise the scheduler sets the scene to each frame
+            attrsInBlender = []
+            if supportsRotation: attrsInBlender.append(rotAnimation.attrInBlender)
+            if supportsPosition: attrsInBlender.append(posAnimation.attrInBlender)
+            if supportsScaling : attrsInBlender.append(scaleAnimation.attrInBlender)
+
+            evaluateDirectly = FCurveEvaluator.isExact(object, attrsInBlender)
+            Logger.log('keys ' + ('evaluated from f-curves directly' if evaluateDirectly else 'sampled by frame'), 3)
+
             currentAction = object.animation_data.action
-            currentFrame = bpy.context.scene.frame_current
-            for action in bpy.data.actions:
+            actions = ActionIndex.instance.get_actions(object)
+            Logger.log(str(len(actions)) + ' of ' + str(len(bpy.data.actions)) + ' actions can affect object', 3)
+            for action in actions:
 
                 if currentActionOnly and currentAction.name != action.name:
                     continue
 
-                # get the range / assigning the action to the object
+                # get the range, frames are always > 0 when one is returned
                 animationRange = AnimationRange.actionPrep(object, action, False, frameOffset)
                 if animationRange is None:
                     continue
 
+                # values of the keys are filled in when the scheduler runs
+                keyedAnimations = []
                 if supportsRotation:
-                    hasData = rotAnimation.append_range(object, animationRange)
+                    keyedAnimations.append((rotAnimation, rotAnimation.append_range(animationRange)))
 
                 if supportsPosition:
-                    hasData |= posAnimation.append_range(object, animationRange)
+                    keyedAnimations.append((posAnimation, posAnimation.append_range(animationRange)))
 
                 if supportsScaling:
-                    hasData |= scaleAnimation.append_range(object, animationRange)
+                    keyedAnimations.append((scaleAnimation, scaleAnimation.append_range(animationRange)))
+
+                if evaluateDirectly:
+                    for animation, firstKey in keyedAnimations:
+                        evaluator = FCurveEvaluator(object, action, animation.attrInBlender)
+                        for idx, frame in enumerate(animationRange.frames_in):
+                            animation.evaluate(evaluator, firstKey + idx, frame)
+                else:
+                    AnimationScheduler.instance.request(object, action, animationRange, FCurveAnimatable.get_sampler(object, keyedAnimations))
 
-                if hasData:
-                    Logger.log('processing action ' + animationRange.to_string(), 3)
-                    self.ranges.append(animationRange)
-                    frameOffset = animationRange.frame_end
+                Logger.log('processing action ' + animationRange.to_string(), 3)
+                self.ranges.append(animationRange)
+                frameOffset = animationRange.frame_end
 
-            object.animation_data.action = currentAction
-            bpy.context.scene.frame_set(currentFrame)
             #Set Animations
             self.animations = []
             if supportsRotation and len(rotAnimation.frames) > 0:
@@ -83,6 +103,27 @@ class FCurveAnimatable:
                     if self.autoAnimateTo < animation.get_last_frame():
                         self.autoAnimateTo = animation.get_last_frame()
                 self.autoAnimateLoop = True
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # called once keys have been sampled; the property in Babylon is also the name of the member with the static value
+    def reduce_animations(self, reducer):
+        if not self.animationsPresent: return
+
+        kept = []
+        for animation in self.animations:
+            reducer.reduce(animation, self.ranges)
+            if not reducer.isConstant(animation, getattr(self, animation.propertyInBabylon, None)):
+                kept.append(animation)
+
+        self.animations = kept
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # keyedAnimations is a list of (animation, index of the first key of the range)
+    @staticmethod
+    def get_sampler(object, keyedAnimations):
+        def sampler(idx):
+            for animation, firstKey in keyedAnimations:
+                animation.sample(object, firstKey + idx)
+
+        return sampler
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
         if (self.animationsPresent):
@@ -4,12 +4,14 @@ from .camera import *
 from .light_shadow import *
 from .logging import *
 from .materials.material import *
+from .materials.texture import TextureRegistry
 from .mesh import *
 from .package_level import *
 from .sound import *
 from .world import *
 
 import bpy
+from concurrent.futures import ThreadPoolExecutor
 from io import open
 from os import path, makedirs
 
@@ -17,6 +19,8 @@ from os import path, makedirs
 import time
 import calendar
 
+# copies & base64 encoding are I/O bound, or release the GIL, so a few threads are enough
+TEXTURE_IO_THREADS = 4
 #===============================================================================
 class JsonExporter:
     nameSpace   = None  # assigned in execute
@@ -31,19 +35,29 @@ class JsonExporter:
         self.lights = []
         self.shadowGenerators = []
         self.skeletons = []
+        self.sourceMeshes = {} # by data name, meshes which later meshes of the same data are instances of
+        self.skeletonIndices = {} # by name, kept in sync with self.skeletons by register_skeleton()
         skeletonId = 0
         self.meshesAndNodes = []
+        self.meshesAndNodesByName = {} # kept in step with meshesAndNodes by register_mesh_or_node()
         self.morphTargetMngrs = []
         self.materials = []
+        self.materialsByName = {} # kept in step with materials by register_material()
         self.multiMaterials = []
         self.sounds = []
         self.needPhysics = False
+        self.spillFile = None
+        self.textureExecutor = None
+        self.tempMeshes = []
+        self.triangulationTime = 0
+        self.nFrameSets = 0
 
         try:
             self.filepathMinusExtension = filepath.rpartition('.')[0]
             JsonExporter.nameSpace = getNameSpace(self.filepathMinusExtension)
 
             log = Logger(self.filepathMinusExtension + '.log')
+            Logger.log_resources('before export', 0)
 
             if bpy.ops.object.mode_set.poll():
                 bpy.ops.object.mode_set(mode = 'OBJECT')
@@ -67,13 +81,32 @@ class JsonExporter:
             Logger.log('UVs Precision       :  ' + format_int(self.settings.UVsPrecision), 2)
             Logger.log('Vert Color Precision:  ' + format_int(self.settings.vColorsPrecision), 2)
             Logger.log('Mat Weight Precision:  ' + format_int(self.settings.mWeightsPrecision), 2)
+            Logger.log('Spill meshes        :  ' + format_bool(self.settings.spillMeshes), 2)
+            Logger.log('Triangulation       :  ' + self.settings.triangulation, 2)
             if not self.inlineTextures:
                 Logger.log('texture directory   :  ' + self.textureFullPathDir, 2)
+            if self.settings.maxTextureSize > 0:
+                Logger.log('Max texture size    :  ' + format_int(self.settings.maxTextureSize), 2)
+            Logger.log('Power of 2 textures :  ' + format_bool(self.settings.powerOfTwoTextures), 2)
+            Logger.log('Opaque PNGs as      :  ' + self.settings.opaquePNGFormat, 2)
+
+            # each image is only copied / encoded once, no matter how many materials / channels use it, & not at all
+            # when still the same as written by a prior export.  Copies & encoding overlap the rest of the export.
+            self.textureExecutor = ThreadPoolExecutor(max_workers = TEXTURE_IO_THREADS)
+            textureRegistry = TextureRegistry(self.textureFullPathDir, self.textureExecutor)
             self.world = World(scene)
 
+            if self.settings.spillMeshes:
+                self.spillFile = MeshSpillFile()
+
             bpy.ops.screen.animation_cancel()
             currentFrame = bpy.context.scene.frame_current
 
+            # all animation sampling is deferred, until every object has requested what it needs
+            scheduler = AnimationScheduler()
+            ActionIndex()
+            materialCache = MaterialNodeTreeCache()
+
             # Active camera
             if scene.camera != None:
                 self.activeCamera = scene.camera.name
@@ -84,28 +117,38 @@ class JsonExporter:
             if self.settings.attachedSound != '':
                 self.sounds.append(Sound(self.settings.attachedSound, self.settings.autoPlaySound, self.settings.loopSound))
 
-            # separate loop doing all skeletons, so available in Mesh to make skipping IK bones possible
+            # one pass to classify objects, scene order is kept within each bucket
+            armatures = []
+            objects = [] # cameras, meshes, & empties
+            lights = []
             for object in scene.objects:
                 if self.shouldBeCulled(object): continue
 
-                scene.frame_set(currentFrame)
+                if object.type == 'ARMATURE' or object.type == 'CAMERA':
+                    if not object.visible_get():
+                        Logger.warn('The following ' + object.type.lower() + ' not visible in scene thus ignored: ' + object.name)
+                        continue
+
                 if object.type == 'ARMATURE':
-                    if object.visible_get():
-                        self.skeletons.append(Skeleton(object, context, skeletonId, self.settings.ignoreIKBones))
-                        skeletonId += 1
-                    else:
-                        Logger.warn('The following armature not visible in scene thus ignored: ' + object.name)
+                    armatures.append(object)
+                elif object.type == 'LIGHT':
+                    lights.append(object)
+                elif object.type == 'CAMERA' or object.type == 'MESH' or object.type == 'EMPTY':
+                    objects.append(object)
+                else:
+                    Logger.warn('The following object (type - ' +  object.type + ') is not currently exportable thus ignored: ' + object.name)
 
-            # exclude light in this pass, so ShadowGenerator constructor can be passed meshesAnNodes
-            for object in scene.objects:
-                if self.shouldBeCulled(object): continue
+            # all skeletons first, so available in Mesh to make skipping IK bones possible
+            for object in armatures:
+                self.restore_frame(currentFrame)
+                self.register_skeleton(Skeleton(object, skeletonId, self.settings.ignoreIKBones))
+                skeletonId += 1
 
-                scene.frame_set(currentFrame)
+            # exclude light in this pass, so ShadowGenerator constructor can be passed meshesAnNodes
+            for object in objects:
+                self.restore_frame(currentFrame)
                 if object.type == 'CAMERA':
-                    if object.visible_get():
-                        self.cameras.append(Camera(object, self))
-                    else:
-                        Logger.warn('The following camera not visible in scene thus ignored: ' + object.name)
+                    self.cameras.append(Camera(object, self))
 
                 elif object.type == 'MESH':
                     mesh = Mesh(object, scene, self)
@@ -121,37 +164,54 @@ class JsonExporter:
                     if hasattr(mesh, 'physicsImpostor'): self.needPhysics = True
 
                     if hasattr(mesh, 'instances'):
-                        self.meshesAndNodes.append(mesh)
+                        self.register_mesh_or_node(mesh)
+                        self.sourceMeshes.setdefault(mesh.dataName, mesh)
                         if hasattr(mesh, 'morphTargetManagerId'):
                             self.morphTargetMngrs.append(mesh)
 
+                        if self.spillFile is not None:
+                            mesh.spill(self.spillFile)
+
                     if object.data.attachedSound != '':
                         self.sounds.append(Sound(object.data.attachedSound, object.data.autoPlaySound, object.data.loopSound, object))
 
-                elif object.type == 'EMPTY':
-                    self.meshesAndNodes.append(Node(object))
-
-                elif object.type != 'LIGHT' and object.type != 'ARMATURE':
-                    Logger.warn('The following object (type - ' +  object.type + ') is not currently exportable thus ignored: ' + object.name)
+                else:
+                    self.register_mesh_or_node(Node(object))
 
             # Lamp / shadow Generator pass; meshesAnNodes complete & forceParents included
-            for object in scene.objects:
-                if self.shouldBeCulled(object): continue
+            for object in lights:
+                bulb = Light(object, self, self.settings.usePBRMaterials)
+                self.lights.append(bulb)
+                if object.data.shadowMap != 'NONE':
+                    if bulb.light_type == DIRECTIONAL_LIGHT or bulb.light_type == SPOT_LIGHT:
+                        self.shadowGenerators.append(ShadowGenerator(object, self.meshesAndNodes, scene))
+                    else:
+                        Logger.warn('Only directional (sun) and spot types of lamp are valid for shadows thus ignored: ' + object.name)
+
+            Logger.log('frame_set calls while extracting:  ' + str(self.nFrameSets), 1)
+            materialCache.log_summary()
+            MaterialNodeTreeCache.instance = None
+
+            Logger.log('========= Sampling of animations =========', 0)
+            scheduler.run()
+            ActionIndex.instance = None
+            for skeleton in self.skeletons:
+                skeleton.collect_animations()
 
-                if object.type == 'LIGHT':
-                    bulb = Light(object, self, self.settings.usePBRMaterials)
-                    self.lights.append(bulb)
-                    if object.data.shadowMap != 'NONE':
-                        if bulb.light_type == DIRECTIONAL_LIGHT or bulb.light_type == SPOT_LIGHT:
-                            self.shadowGenerators.append(ShadowGenerator(object, self.meshesAndNodes, scene))
-                        else:
-                            Logger.warn('Only directional (sun) and spot types of lamp are valid for shadows thus ignored: ' + object.name)
+            if self.settings.reduceKeyframes:
+                reducer = KeyframeReducer(self.settings)
+                for animatable in self.skeletons + self.meshesAndNodes + self.cameras + self.lights:
+                    animatable.reduce_animations(reducer)
+                reducer.log_summary()
+            self.restore_frame(currentFrame)
 
-            bpy.context.scene.frame_set(currentFrame)
+            self.log_memory_report()
 
             # output file
             if log.nErrors == 0:
                 self.to_json_file()
+                textureRegistry.finish()
+                textureRegistry.log_summary()
             else:
                 Logger.log('Output cancelled due to data error')
 
@@ -160,6 +220,21 @@ class JsonExporter:
             raise
 
         finally:
+            # only left over when an exception was raised during extraction
+            for mesh in self.tempMeshes:
+                bpy.data.meshes.remove(mesh)
+            self.tempMeshes = []
+            if self.textureExecutor is not None:
+                self.textureExecutor.shutdown(wait = True)
+                self.textureExecutor = None
+            if TextureRegistry.instance is not None:
+                TextureRegistry.instance.cleanup()
+                TextureRegistry.instance = None
+
+            if self.spillFile is not None:
+                self.spillFile.close()
+
+            Logger.log_resources('after export', 0)
             log.close()
 
         self.nWarnings = log.nWarnings
@@ -205,6 +280,18 @@ class JsonExporter:
             skeleton.to_json_file(file_handler)
         file_handler.write(']')
 
+        # Transform nodes, of bones with TRS animation
+        file_handler.write(',\n"transformNodes":[')
+        first = True
+        for skeleton in self.skeletons:
+            for transformNode in skeleton.get_transform_nodes():
+                if first != True:
+                    file_handler.write(',')
+
+                first = False
+                transformNode.to_json_file(file_handler)
+        file_handler.write(']')
+
         # Meshes
         file_handler.write(',\n"meshes":[')
         first = True
@@ -236,7 +323,7 @@ class JsonExporter:
                 file_handler.write(',')
 
             first = False
-            camera.update_for_target_attributes(self.meshesAndNodes)
+            camera.update_for_target_attributes(self.meshesAndNodesByName)
             camera.to_json_file(file_handler)
         file_handler.write(']')
 
@@ -295,34 +382,65 @@ class JsonExporter:
 
         Logger.log('========= Writing of JSON file completed =========', 0)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def getMaterial(self, baseMaterialId):
-        for material in self.materials:
-            if material.name == baseMaterialId:
-                return material
+    def log_memory_report(self):
+        Logger.log('========= Mesh memory report =========', 0)
+        totalBytes = 0
+        for mesh in self.meshesAndNodes:
+            if not hasattr(mesh, 'get_geometry_bytes'): continue # nodes have no geometry
+
+            nBytes = mesh.get_geometry_bytes()
+            totalBytes += nBytes
+            Logger.log(mesh.name + ':  ' + format_int(nBytes) + ' bytes' + (', spilled' if hasattr(mesh, 'spillRecord') else ''), 1)
 
-        return None
+        Logger.log('total geometry:  ' + format_int(totalBytes) + ' bytes', 1)
+        Logger.log('total triangulation time (' + self.settings.triangulation + '):  ' + format_f(self.triangulationTime) + ' secs', 1)
+        if self.spillFile is not None:
+            Logger.log('spilled JSON  :  ' + format_int(self.spillFile.nBytes) + ' bytes', 1)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    def getSourceMeshInstance(self, dataName):
-        for mesh in self.meshesAndNodes:
-            # nodes have no 'dataName', cannot be instanced in any case
-            if hasattr(mesh, 'dataName') and mesh.dataName == dataName:
-                return mesh
+    # a copy of the mesh with modifiers applied, added to bpy.data.meshes; must be released
+    def get_temp_mesh(self, bpyMesh):
+        mesh = bpyMesh.to_mesh(bpy.context.depsgraph, True)
+        self.tempMeshes.append(mesh)
+        return mesh
+
+    def release_temp_mesh(self, mesh):
+        self.tempMeshes.remove(mesh)
+        bpy.data.meshes.remove(mesh)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def register_material(self, material):
+        self.materials.append(material)
+        self.materialsByName.setdefault(material.name, material)
 
-        return None
+    def getMaterial(self, baseMaterialId):
+        return self.materialsByName.get(baseMaterialId)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def register_mesh_or_node(self, meshOrNode):
+        self.meshesAndNodes.append(meshOrNode)
+        self.meshesAndNodesByName.setdefault(meshOrNode.name, meshOrNode)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def getSourceMeshInstance(self, dataName):
+        # nodes have no 'dataName', cannot be instanced in any case
+        return self.sourceMeshes.get(dataName)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # frame_set re-evaluates the whole depsgraph, so only done when something actually moved the frame
+    def restore_frame(self, frame):
+        scene = bpy.context.scene
+        if scene.frame_current != frame:
+            scene.frame_set(frame)
+            self.nFrameSets += 1
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def register_skeleton(self, skeleton):
+        self.skeletonIndices[skeleton.name] = len(self.skeletons)
+        self.skeletons.append(skeleton)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def get_skeleton(self, name):
-        for skeleton in self.skeletons:
-            if skeleton.name == name:
-                return skeleton
+        idx = self.skeletonIndices.get(name)
         #really cannot happen, will cause exception in caller
-        return None
+        return self.skeletons[idx] if idx is not None else None
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def get_skeletonIndex(self, name):
-        for idx,skeleton in enumerate(self.skeletons):
-            if skeleton.name == name:
-                return idx
         #really cannot happen, will cause exception in caller
-        return None
+        return self.skeletonIndices.get(name)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def shouldBeCulled(self, object):
         return object.hide_viewport or object.users_collection[0].hide_viewport
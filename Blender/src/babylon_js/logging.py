@@ -1,10 +1,11 @@
 from .package_level import format_f, format_exporter_version
 
+import bpy
 from bpy import app
 from io import open
 from math import floor
 from time import time
-from sys import exc_info
+from sys import exc_info, platform
 from traceback import format_tb
 
 class Logger:
@@ -40,6 +41,13 @@ class Logger:
         self.log_handler.close()
         Logger.instance = None
 
+    # instrumentation for memory growth across exports, e.g. left over temporary meshes
+    @staticmethod
+    def log_resources(stage, numTabIndent = 1):
+        rss = get_process_rss()
+        rssText = 'n/a' if rss is None else format_f(rss / 1048576, 1) + ' MB'
+        Logger.log(stage + ':  bpy.data.meshes: ' + str(len(bpy.data.meshes)) + ', process RSS: ' + rssText, numTabIndent)
+
     @staticmethod
     def error(msg):
         Logger.log('\nERROR: ' + msg.upper() + '\n', 0, False)
@@ -60,4 +68,39 @@ class Logger:
 
         Logger.instance.log_handler.write(msg)
         print(msg) # for debugging / running Blender fron console
-        if not noNewLine: Logger.instance.log_handler.write('\n')
\ No newline at end of file
+        if not noNewLine: Logger.instance.log_handler.write('\n')
+#===============================================================================
+# resident set size of Blender in bytes, or None when it cannot be determined
+def get_process_rss():
+    try:
+        import psutil # not shipped with Blender, but use when installed
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    if platform == 'win32':
+        from ctypes import byref, c_size_t, sizeof, windll, wintypes, POINTER, Structure
+        class PROCESS_MEMORY_COUNTERS(Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', c_size_t), ('WorkingSetSize', c_size_t),
+                        ('QuotaPeakPagedPoolUsage', c_size_t), ('QuotaPagedPoolUsage', c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', c_size_t), ('QuotaNonPagedPoolUsage', c_size_t),
+                        ('PagefileUsage', c_size_t), ('PeakPagefileUsage', c_size_t)]
+
+        # declare handle types, so they are not truncated to 32 bit ints
+        windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        windll.psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = sizeof(counters)
+        if windll.psapi.GetProcessMemoryInfo(windll.kernel32.GetCurrentProcess(), byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    # Linux; statm reports in pages
+    try:
+        from os import sysconf # not on Windows
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
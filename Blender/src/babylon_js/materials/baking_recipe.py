@@ -84,10 +84,12 @@ class BakingRecipe:
             # when baking let the values of any custom properties come from the first node material
             self.bakedMaterial = BJSMaterial(firstMatUsingNodes, exporter)
             if not isMultiMaterial:
-                # there may be other image textures, which could be transferred when not multi material
+                # there may be other image textures, which could be transferred when not multi material.  Parsed again,
+                # since a cached tree & its textures are shared with the material when registered un-baked
+                self.bakedMaterial.bjsNodeTree = AbstractBJSNode.readMaterialNodeTree(self.node_trees[0])
                 self.bakedMaterial.processImageTextures(bpyMesh)
 
             self.bakedMaterial.bake(bpyMesh, self)
 
-            exporter.materials.append(self.bakedMaterial)
+            exporter.register_material(self.bakedMaterial)
             exporter.hasTextures = True
\ No newline at end of file
@@ -2,12 +2,59 @@ from ..logging import *
 from ..package_level import *
 
 from .nodes.abstract import *
-from .texture import BakedTexture
+from .texture import BakedTexture, PackedMetallicTexture, PACKED_METALLIC_CHANNELS
 
 import bpy
 
 DEFAULT_MATERIAL_NAMESPACE = 'Same as Filename'
 #===============================================================================
+# Parsed node trees, by material, for the duration of an export.  A material used by many meshes is otherwise parsed
+# for every slot it is in.  The cached tree holds the bake decision (mustBake*) & the textures too.  An entry is
+# re-parsed when the signature of its node tree (nodes, links, unlinked input values, images) has changed.
+class MaterialNodeTreeCache:
+    instance = None
+
+    def __init__(self):
+        self.entries = {} # key material pointer, value (signature, bjsNodeTree)
+        self.nHits = 0
+        self.nMisses = 0
+
+        # allow BJSMaterial to use, without the exporter needing to be passed everywhere
+        MaterialNodeTreeCache.instance = self
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get(self, bpyMaterial):
+        key = bpyMaterial.as_pointer()
+        signature = MaterialNodeTreeCache.getSignature(bpyMaterial.node_tree)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self.nHits += 1
+            Logger.log('node tree from cache', 3)
+            return entry[1]
+
+        self.nMisses += 1
+        bjsNodeTree = AbstractBJSNode.readMaterialNodeTree(bpyMaterial.node_tree)
+        self.entries[key] = (signature, bjsNodeTree)
+        return bjsNodeTree
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def log_summary(self):
+        Logger.log('material node trees:  ' + str(self.nMisses) + ' parsed, ' + str(self.nHits) + ' cache hits', 1)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def getSignature(node_tree):
+        signature = []
+        for node in node_tree.nodes:
+            signature.append((node.name, node.bl_idname, node.image.name if getattr(node, 'image', None) else None))
+            for input in node.inputs:
+                if not input.is_linked and hasattr(input, 'default_value'):
+                    value = input.default_value
+                    signature.append(tuple(value) if hasattr(value, '__len__') else value)
+
+        for link in node_tree.links:
+            signature.append((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier))
+
+        return tuple(signature)
+#===============================================================================
 class MultiMaterial:
     def __init__(self, material_slots, idx, nameSpace):
         self.name = nameSpace + '.' + 'Multimaterial#' + str(idx)
@@ -51,7 +98,8 @@ class BJSMaterial:
             Logger.log('processing begun of material:  ' +  self.name, 2)
 
             if self.use_nodes:
-                self.bjsNodeTree = AbstractBJSNode.readMaterialNodeTree(bpyMaterial.node_tree)
+                cache = MaterialNodeTreeCache.instance
+                self.bjsNodeTree = cache.get(bpyMaterial) if cache is not None else AbstractBJSNode.readMaterialNodeTree(bpyMaterial.node_tree)
             else:
                 self.diffuseColor = bpyMaterial.diffuse_color
                 self.specularColor = bpyMaterial.specular_intensity * bpyMaterial.specular_color
@@ -65,11 +113,49 @@ class BJSMaterial:
     def processImageTextures(self, bpyMesh):
         if not self.use_nodes: return False
 
+        # decided first, so sources only feeding the packed texture are never written themselves
+        packSources = self.getMetallicPackSources() if self.isPBR else None
+        packOnly = set()
+        if packSources is not None:
+            packOnly = set(id(tex) for tex in packSources if tex is not None)
+            for texType, tex in self.bjsNodeTree.bjsTextures.items():
+                if texType not in PACKED_METALLIC_CHANNELS:
+                    packOnly.discard(id(tex))
+
         for texType, tex in self.bjsNodeTree.bjsTextures.items():
             self.textures[texType] = tex
-            tex.process(self.textureFullPathDir, True, bpyMesh)
+            if id(tex) not in packOnly:
+                tex.process(self.textureFullPathDir, True, bpyMesh)
+
+        if packSources is not None:
+            packed = PackedMetallicTexture(self.name, packSources, self.textureFullPathDir, bpyMesh)
+            if packed.failed:
+                # as when mappings differ, the sources are written on their own, so only one is used
+                for tex in packSources:
+                    if tex is not None and id(tex) in packOnly:
+                        packOnly.discard(id(tex))
+                        tex.process(self.textureFullPathDir, True, bpyMesh)
+            else:
+                for texType in PACKED_METALLIC_CHANNELS:
+                    if texType in self.textures:
+                        self.textures[texType] = packed
 
         return len(self.textures.items()) > 0
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # Babylon reads metal, roughness & AO from one texture.  When they come from more than one image, they are combined,
+    # so none are dropped when written.  Returns the [AO, roughness, metal] sources, or None when not to be packed.
+    # The nodes' own textures are left alone, being shared through the tree cache.
+    def getMetallicPackSources(self):
+        textures = self.bjsNodeTree.bjsTextures
+        sources = [textures.get(texType) for texType in PACKED_METALLIC_CHANNELS]
+        images = set(tex.image.as_pointer() for tex in sources if tex is not None)
+        if len(images) < 2: return None
+
+        if not PackedMetallicTexture.haveSameMapping(sources):
+            Logger.warn('Metal / roughness / AO textures use different UV maps or mappings, not packed, so only one is used', 3)
+            return None
+
+        return sources
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def bake(self, bpyMesh, recipe):
         # texture is baked from selected mesh(es), need to insure this mesh is only one selected
@@ -2,6 +2,8 @@
 # done as needed in various methods
 from babylon_js.logging import *
 
+from copy import copy
+
 # various texture types, value contains the BJS name when needed to be written in output
 ENVIRON_TEX    = 'value not meaningful 1'
 
@@ -22,6 +24,12 @@ REFRACTION_TEX = 'refractionTexture'
 UV_ACTIVE_TEXTURE = 'value not meaningful 3'
 #===============================================================================
 class AbstractBJSNode:
+    # wrapper class by bl_idname, built on first use, since sub-classes cannot be imported at the module level
+    wrapperClasses = None
+
+    # wrappers already made during the current readNodeTree(), by (node, output socket); a node feeding many sockets
+    # is only wrapped once, instead of once for every path to it
+    wrapperMemo = {}
 
     def __init__(self, bpyNode, socketName, isTopLevel = False):
         self.socketName = socketName
@@ -63,7 +71,8 @@ class AbstractBJSNode:
             # there are a maximum of 1 inputs per socket
             if len(nodeSocket.links) == 1:
                 # recursive instancing of inputs with their matching wrapper sub-class
-                bjsWrapperNode = AbstractBJSNode.GetBJSWrapperNode(nodeSocket.links[0].from_node, nodeSocket.name)
+                link = nodeSocket.links[0]
+                bjsWrapperNode = AbstractBJSNode.GetBJSWrapperNode(link.from_node, nodeSocket.name, link.from_socket)
                 self.bubbleUp(bjsWrapperNode)
                 self.bjsInputs[nodeSocket.name] = bjsWrapperNode
             #    print (nodeSocket.name + ' @ ' + str(nodeSocket.links[0]))
@@ -180,6 +189,11 @@ class AbstractBJSNode:
         if isinstance(input, TextureImageBJSNode) or isinstance(input, TextureEnvironmentBJSNode):
             if input.unAssignedBjsTexture is not None:
                 bjsImageTexture = input.unAssignedBjsTexture
+
+                # a memoized node can feed more than one channel, each needs its own texture
+                if hasattr(bjsImageTexture, 'textureType') and bjsImageTexture.textureType != textureType:
+                    bjsImageTexture = copy(bjsImageTexture)
+
                 bjsImageTexture.assignChannel(textureType) # add channel directly to texture, so it also knows what type it is
 
                 # add texture to nodes dictionary, for bubbling up which reduces multiples
@@ -230,10 +244,30 @@ class AbstractBJSNode:
         if output is None:
             return None
 
-        return AbstractBJSNode(output, topLevelId, True)
+        AbstractBJSNode.wrapperMemo = {}
+        try:
+            return AbstractBJSNode(output, topLevelId, True)
+        finally:
+            AbstractBJSNode.wrapperMemo = {}
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     @staticmethod
-    def GetBJSWrapperNode(bpyNode, socketName):
+    def GetBJSWrapperNode(bpyNode, socketName, fromSocket = None):
+        from .unsupported import UnsupportedNode
+
+        key = (bpyNode.as_pointer(), fromSocket.identifier if fromSocket is not None else None)
+        bjsWrapperNode = AbstractBJSNode.wrapperMemo.get(key)
+        if bjsWrapperNode is None:
+            wrapperClass = AbstractBJSNode.GetWrapperClasses().get(bpyNode.bl_idname, UnsupportedNode)
+            bjsWrapperNode = wrapperClass(bpyNode, socketName)
+            AbstractBJSNode.wrapperMemo[key] = bjsWrapperNode
+
+        return bjsWrapperNode
+
+    @staticmethod
+    def GetWrapperClasses():
+        if AbstractBJSNode.wrapperClasses is not None:
+            return AbstractBJSNode.wrapperClasses
+
         from .ambient_occlusion import AmbientOcclusionBJSNode
         from .background import BackgroundBJSNode
         from .diffuse import DiffuseBJSNode
@@ -251,58 +285,15 @@ class AbstractBJSNode:
         from .tex_image import TextureImageBJSNode
         from .transparency import TransparentBJSNode
         from .uv_map import UVMapBJSNode
-        from .unsupported import UnsupportedNode
-
-        if AmbientOcclusionBJSNode.bpyType == bpyNode.bl_idname:
-            return AmbientOcclusionBJSNode(bpyNode, socketName)
-
-        elif BackgroundBJSNode.bpyType == bpyNode.bl_idname:
-            return BackgroundBJSNode(bpyNode, socketName)
-
-        elif DiffuseBJSNode.bpyType == bpyNode.bl_idname:
-            return DiffuseBJSNode(bpyNode, socketName)
 
-        elif EmissionBJSNode.bpyType == bpyNode.bl_idname:
-            return EmissionBJSNode(bpyNode, socketName)
+        wrapperClasses = {}
+        for wrapperClass in (AmbientOcclusionBJSNode, BackgroundBJSNode, DiffuseBJSNode, EmissionBJSNode, FresnelBJSNode,
+                             GlossyBJSNode, GltfBJSNode, MappingBJSNode, NormalMapBJSNode, PrincipledBJSNode, RefractionBJSNode,
+                             TextureCoordBJSNode, TextureEnvironmentBJSNode, TextureImageBJSNode, TransparentBJSNode, UVMapBJSNode):
+            wrapperClasses[wrapperClass.bpyType] = wrapperClass
 
-        elif FresnelBJSNode.bpyType == bpyNode.bl_idname:
-            return FresnelBJSNode(bpyNode, socketName)
+        for bpyType in PassThruBJSNode.PASS_THRU_SHADERS.split():
+            wrapperClasses[bpyType] = PassThruBJSNode
 
-        elif GlossyBJSNode.bpyType == bpyNode.bl_idname:
-            return GlossyBJSNode(bpyNode, socketName)
-
-        elif GltfBJSNode.bpyType == bpyNode.bl_idname:
-            return GltfBJSNode(bpyNode, socketName)
-
-        elif MappingBJSNode.bpyType == bpyNode.bl_idname:
-            return MappingBJSNode(bpyNode, socketName)
-
-        elif NormalMapBJSNode.bpyType == bpyNode.bl_idname:
-            return NormalMapBJSNode(bpyNode, socketName)
-
-        elif bpyNode.bl_idname in PassThruBJSNode.PASS_THRU_SHADERS:
-            return PassThruBJSNode(bpyNode, socketName)
-
-        elif PrincipledBJSNode.bpyType == bpyNode.bl_idname:
-            return PrincipledBJSNode(bpyNode, socketName)
-
-        elif RefractionBJSNode.bpyType == bpyNode.bl_idname:
-            return RefractionBJSNode(bpyNode, socketName)
-
-        elif TextureCoordBJSNode.bpyType == bpyNode.bl_idname:
-            return TextureCoordBJSNode(bpyNode, socketName)
-
-        elif TextureEnvironmentBJSNode.bpyType == bpyNode.bl_idname:
-            return TextureEnvironmentBJSNode(bpyNode, socketName)
-
-        elif TextureImageBJSNode.bpyType == bpyNode.bl_idname:
-            return TextureImageBJSNode(bpyNode, socketName)
-
-        elif TransparentBJSNode.bpyType == bpyNode.bl_idname:
-            return TransparentBJSNode(bpyNode, socketName)
-
-        elif UVMapBJSNode.bpyType == bpyNode.bl_idname:
-            return UVMapBJSNode(bpyNode, socketName)
-
-        else:
-            return UnsupportedNode(bpyNode, socketName)
\ No newline at end of file
+        AbstractBJSNode.wrapperClasses = wrapperClasses
+        return wrapperClasses
\ No newline at end of file
@@ -1,15 +1,20 @@
 from ..logging import *
 from ..package_level import *
 
-from .nodes.abstract import UV_ACTIVE_TEXTURE
+from .nodes.abstract import UV_ACTIVE_TEXTURE, AMBIENT_TEX, ROUGHNESS_TEX, METAL_TEX
 from .nodes.mapping import MappingBJSNode
 
 import bpy
 
 from base64 import b64encode
-from os import path, remove
+from hashlib import sha1
+from json import dump, load
+from mmap import mmap, ACCESS_READ
+from os import path, remove, stat
 from shutil import copy
 from sys import exc_info # for writing errors to log file
+from time import perf_counter
+import numpy as np
 
 # used externally by TextureImageBJSNode, defined in BABYLON.Texture
 CLAMP_ADDRESSMODE = 0
@@ -25,6 +30,505 @@ CUBIC_MODE = 3
 #SKYBOX_MODE = 5
 
 NON_ALPHA_FORMATS = {'BMP', 'JPEG'}
+
+# bits per pixel of loaded images with no alpha plane; grayscale, RGB bytes & RGB floats
+NON_ALPHA_DEPTHS = {8, 24, 96}
+
+# max values read at a time when scanning alpha through slices of image.pixels, which are Python floats
+ALPHA_SCAN_VALUES = 1 << 22
+
+HASH_CHUNK_SIZE = 1 << 20
+BASE64_CHUNK_SIZE = 3 << 18 # multiple of 3, so chunks encode without padding & can be concatenated
+
+# suffixes of the file name & divisors, for reduced resolution variants
+TEXTURE_VARIANTS = (('_half', 2), ('_quarter', 4))
+
+# channels of a packed metallic texture, in the order of R, G & B
+PACKED_METALLIC_CHANNELS = (AMBIENT_TEX, ROUGHNESS_TEX, METAL_TEX)
+
+# formats which opaque PNGs can be re-encoded to, & their extensions
+REENCODE_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+MANIFEST_FILE = 'babylon_textures.manifest'
+#===============================================================================
+# Copies / encodes each image once per export, sharing the result with every texture of the same image.  Images are
+# looked up by resolved path (or the packed image), then by content hash, so identical images under different names
+# also only get written once.  Baked images are never shared, since the same image is re-baked for each channel.
+# A manifest in the texture directory also allows skipping files already written by a previous export.
+#
+# Copies are run as TextureIOJobs on the executor passed, which is owned by the exporter.  Inline textures are streamed
+# from file into the .babylon when written, so the temporary files of internal images are kept until cleanup().
+class TextureRegistry:
+    instance = None
+
+    def __init__(self, textureFullPathDir, executor = None):
+        self.byKey = {}  # key (resolved path or packed image pointer, inlined, re-encoding, sizing), value entry
+        self.byHash = {} # key (content hash, inlined, re-encoding, sizing), value entry
+        self.manifest = TextureManifest(textureFullPathDir)
+        self.executor = executor
+        self.jobs = []
+        self.tempFiles = []
+        self.pendingRecords = [] # manifest records, which can only be made once the output has been written
+        self.hashBySource = {}  # key resolved path or packed image pointer, value (source stats, hash, size in bytes)
+        self.alphaByHash = {}   # key content hash, value whether any pixel is not opaque
+        self.packedByKey = {}   # key (hashes of packed inputs & size, inlined), value (file name, name, inline file)
+        self.nWritten = 0
+        self.nUpToDate = 0
+        self.nShared = 0
+        self.nBytesSaved = 0
+        self.secsSaved = 0
+
+        # allow textures to use, without the exporter needing to be passed everywhere
+        TextureRegistry.instance = self
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def canShare(texture):
+        return texture.image.packed_file or not texture.isInternalImage
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def getSource(image):
+        return image.as_pointer() if image.packed_file else path.normpath(bpy.path.abspath(image.filepath))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (source stats, hash, size in bytes) of an image, only reading it when not known from the manifest
+    def getImageHash(self, image):
+        source = TextureRegistry.getSource(image)
+        known = self.hashBySource.get(source)
+        if known is None:
+            sourceStats = self.manifest.getSourceStats(image, source)
+            contentHash, nBytes = self.manifest.getKnownHash(sourceStats)
+            if contentHash is None:
+                contentHash, nBytes = TextureRegistry.getContentHash(image)
+
+            known = (sourceStats, contentHash, nBytes)
+            self.hashBySource[source] = known
+
+        return known
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def process(self, texture, textureFullPathDir, inlineTextures, sizing):
+        image = texture.image
+        signature, variants = TextureSizing.describe(sizing, image, texture.fileNoPath, inlineTextures)
+        if texture.reencode is not None:
+            signature += ' as ' + texture.reencode[0] + ' ' + str(texture.reencode[1])
+
+        # the re-encoding depends on the colorspace, not just the bytes, & what is written on the caller's sizing, e.g.
+        # none for the environment texture, so images can only share when both agree
+        sizingKey = (signature, len(variants) > 0)
+        key = (TextureRegistry.getSource(image), inlineTextures, texture.reencode, sizingKey)
+
+        entry = self.byKey.get(key)
+        if entry is None:
+            sourceStats, contentHash, nBytes = self.getImageHash(image)
+            hashKey = (contentHash, inlineTextures, texture.reencode, sizingKey)
+            entry = self.byHash.get(hashKey) if contentHash is not None else None
+
+            if entry is None:
+                # inlined textures are not left in the texture directory, so only files can be up to date
+                if not inlineTextures and self.manifest.isUpToDate(texture.fileNoPath, contentHash, signature, variants):
+                    Logger.log('texture ' + texture.name + ' up to date from prior export', 3)
+                    entry = TextureRegistryEntry(texture, nBytes, 0)
+                    self.nUpToDate += 1
+                else:
+                    startTime = perf_counter()
+                    texture.write(textureFullPathDir, inlineTextures, sizing)
+                    entry = TextureRegistryEntry(texture, nBytes, perf_counter() - startTime)
+                    self.nWritten += 1
+                    if not inlineTextures and contentHash is not None:
+                        self.pendingRecords.append((texture.ioJob, texture.fileNoPath, sourceStats, contentHash, nBytes, signature, variants))
+
+                if contentHash is not None:
+                    self.byHash[hashKey] = entry
+
+                self.byKey[key] = entry
+                return
+
+            Logger.log('texture ' + texture.name + ' identical to ' + entry.name, 3)
+            self.byKey[key] = entry
+
+        entry.assign_to(texture)
+        entry.nShared += 1
+        self.nShared += 1
+        self.nBytesSaved += entry.nBytes
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def cleanup(self):
+        for tempFile in self.tempFiles:
+            if path.isfile(tempFile):
+                remove(tempFile)
+        self.tempFiles = []
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # wait for any jobs not already waited on, when writing the texture blocks, e.g. environment textures
+    def finish(self):
+        for job in self.jobs:
+            job.result()
+
+        for job, fileNoPath, sourceStats, contentHash, nBytes, signature, variants in self.pendingRecords:
+            if job is None or not job.failed:
+                self.manifest.record(fileNoPath, sourceStats, contentHash, nBytes, signature, variants)
+        self.pendingRecords = []
+        self.manifest.save()
+
+        # an entry matched by content hash is also under the key of each image matched, so only count it once
+        uniqueEntries = {id(entry): entry for entry in self.byKey.values()}.values()
+        for entry in uniqueEntries:
+            self.secsSaved += entry.nShared * (entry.secs + (entry.ioJob.secs if entry.ioJob is not None else 0))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def log_summary(self):
+        Logger.log('textures:  ' + str(self.nWritten) + ' written, ' + str(self.nUpToDate) + ' up to date, ' + str(self.nShared) + ' shared, saving ' + format_int(self.nBytesSaved) + ' bytes & ' + format_f(self.secsSaved) + ' secs', 1)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (hash, size in bytes), or (None, 0) when the content cannot be read
+    @staticmethod
+    def getContentHash(image):
+        hasher = sha1()
+        nBytes = 0
+        try:
+            if image.packed_file:
+                data = image.packed_file.data
+                hasher.update(data)
+                nBytes = len(data)
+            else:
+                with open(path.normpath(bpy.path.abspath(image.filepath)), 'rb') as file:
+                    chunk = file.read(HASH_CHUNK_SIZE)
+                    while len(chunk) > 0:
+                        hasher.update(chunk)
+                        nBytes += len(chunk)
+                        chunk = file.read(HASH_CHUNK_SIZE)
+        except:
+            return None, 0
+
+        return hasher.hexdigest(), nBytes
+#===============================================================================
+# Records, per file written to the texture directory, where it came from, so the next export can skip re-copying /
+# re-rendering it.  File backed images are recognised by source size & mtime, without needing to re-read them to hash;
+# packed images by the hash of their packed data, so save_render is skipped too.
+class TextureManifest:
+    def __init__(self, textureFullPathDir):
+        self.textureFullPathDir = textureFullPathDir
+        self.filepath = path.join(textureFullPathDir, MANIFEST_FILE)
+        self.outputs = {} # key output file name, value dict of source, size, mtime, hash, sizing, variants, outputSize & outputMtime
+        self.bySource = {} # the first lookup is by source, which need not be the name the output was written as
+        self.changed = False
+
+        try:
+            if path.isfile(self.filepath):
+                with open(self.filepath, 'r', encoding='utf8') as file:
+                    self.outputs = load(file)
+
+                for record in self.outputs.values():
+                    self.bySource[record['source']] = record
+        except:
+            ex = exc_info()
+            Logger.warn('Texture manifest ignored, could not be read:\n\t\t\t'+ str(ex[1]), 2)
+            self.outputs = {}
+            self.bySource = {}
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (source, size, mtime); packed images have no mtime, so are always hashed
+    @staticmethod
+    def getSourceStats(image, source):
+        if image.packed_file:
+            return ('packed:' + image.name, image.packed_file.size, None)
+
+        try:
+            stats = stat(source)
+            return (source, stats.st_size, stats.st_mtime)
+        except:
+            return (source, None, None)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (hash, size in bytes) recorded for an unchanged source file, or (None, 0)
+    def getKnownHash(self, sourceStats):
+        source, size, mtime = sourceStats
+        record = self.bySource.get(source)
+        if mtime is None or record is None or record['size'] != size or record['mtime'] != mtime:
+            return None, 0
+
+        return record['hash'], size
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # the output must also still be the one written, not deleted or overwritten by something else, & at the same size
+    def isUpToDate(self, fileNoPath, contentHash, signature, variants):
+        record = self.outputs.get(fileNoPath)
+        if contentHash is None or record is None or record['hash'] != contentHash:
+            return False
+
+        if record.get('sizing', '') != signature or record.get('variants', []) != variants:
+            return False
+
+        for variant in variants:
+            if not path.isfile(path.join(self.textureFullPathDir, variant)):
+                return False
+
+        try:
+            stats = stat(path.join(self.textureFullPathDir, fileNoPath))
+            return stats.st_size == record['outputSize'] and stats.st_mtime == record['outputMtime']
+        except:
+            return False
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def record(self, fileNoPath, sourceStats, contentHash, nBytes, signature, variants):
+        try:
+            stats = stat(path.join(self.textureFullPathDir, fileNoPath))
+        except:
+            return # write failed, already warned
+
+        source, size, mtime = sourceStats
+        record = {'source': source, 'size': size if size is not None else nBytes, 'mtime': mtime, 'hash': contentHash,
+                  'sizing': signature, 'variants': variants, 'outputSize': stats.st_size, 'outputMtime': stats.st_mtime}
+        self.outputs[fileNoPath] = record
+        self.bySource[source] = record
+        self.changed = True
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def save(self):
+        if not self.changed: return
+
+        try:
+            with open(self.filepath, 'w', encoding='utf8') as file:
+                dump(self.outputs, file, indent = 1, sort_keys = True)
+            self.changed = False
+        except:
+            ex = exc_info()
+            Logger.warn('Texture manifest could not be written:\n\t\t\t'+ str(ex[1]), 2)
+#===============================================================================
+# The export's limits on texture dimensions:  clamping to a max size, rounding to powers of 2, & optionally reduced
+# resolution variants for device adaptive loading.  Scaling is always of a copy, never the artist's image.
+class TextureSizing:
+    def __init__(self, maxSize, powerOfTwo, writeVariants):
+        self.maxSize = maxSize # 0 for no limit
+        self.powerOfTwo = powerOfTwo
+        self.writeVariants = writeVariants
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def fromSettings(settings):
+        sizing = TextureSizing(settings.maxTextureSize, settings.powerOfTwoTextures, settings.textureVariants)
+        return sizing if sizing.maxSize > 0 or sizing.powerOfTwo or sizing.writeVariants else None
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (width, height) to write an image of the size passed, or None when it can stay as is
+    def getTargetSize(self, width, height):
+        if width == 0 or height == 0: return None # not loadable, leave to the copy to report
+
+        targetWidth, targetHeight = width, height
+        if self.maxSize > 0 and max(width, height) > self.maxSize:
+            factor = self.maxSize / max(width, height)
+            targetWidth  = max(1, round(width  * factor))
+            targetHeight = max(1, round(height * factor))
+
+        if self.powerOfTwo:
+            targetWidth  = self.nearestPowerOfTwo(targetWidth)
+            targetHeight = self.nearestPowerOfTwo(targetHeight)
+
+        if targetWidth == width and targetHeight == height: return None
+        return (targetWidth, targetHeight)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def nearestPowerOfTwo(self, value):
+        power = 1 << int(round(np.log2(value)))
+        while self.maxSize > 0 and power > self.maxSize and power > 1:
+            power >>= 1
+        return power
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns [(file name, width, height)] of each variant, of an output file of the size passed
+    def getVariants(self, fileNoPath, width, height):
+        if not self.writeVariants: return []
+
+        base, dot, extension = fileNoPath.rpartition('.')
+        return [(base + suffix + dot + extension, max(1, width // divisor), max(1, height // divisor)) for suffix, divisor in TEXTURE_VARIANTS]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # returns (signature, variant file names) of what would be written for the image, for the manifest
+    @staticmethod
+    def describe(sizing, image, fileNoPath, inlineTextures):
+        if sizing is None: return '', []
+
+        width, height = image.size
+        targetSize = sizing.getTargetSize(width, height)
+        if targetSize is not None:
+            width, height = targetSize
+
+        signature = str(width) + 'x' + str(height) if targetSize is not None else ''
+        variants = [] if inlineTextures else [name for name, w, h in sizing.getVariants(fileNoPath, width, height)]
+        return signature, variants
+#===============================================================================
+# what write() of the first texture of an image produced, for the others to share
+class TextureRegistryEntry:
+    def __init__(self, texture, nBytes, secs):
+        self.fileNoPath = texture.fileNoPath
+        self.name = texture.name
+        self.ioJob = texture.ioJob if hasattr(texture, 'ioJob') else None
+        self.inlineFile = texture.inlineFile if hasattr(texture, 'inlineFile') else None
+        self.nBytes = nBytes
+        self.secs = secs # on the main thread, the job's own time is added when done
+        self.nShared = 0
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def assign_to(self, texture):
+        texture.fileNoPath = self.fileNoPath
+        texture.name = self.name
+        texture.ioJob = self.ioJob
+        texture.inlineFile = self.inlineFile
+#===============================================================================
+# The copy of a file backed texture, which does not call bpy, so can overlap with the extraction of geometry.  Runs on
+# the registry's executor, or immediately when there is none.  Nothing in run() may log either, so any exception is
+# only reported when the result is asked for, on the main thread.
+class TextureIOJob:
+    def __init__(self, textureName, textureFile, textureFullPathDir):
+        self.textureName = textureName
+        self.textureFile = textureFile
+        self.textureFullPathDir = textureFullPathDir
+        self.failed = False
+        self.secs = 0
+
+        registry = TextureRegistry.instance
+        if registry is not None and registry.executor is not None:
+            self.future = registry.executor.submit(self.run)
+            registry.jobs.append(self)
+        else:
+            self.future = None
+            self.resolve(self.run)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def run(self):
+        startTime = perf_counter()
+        copy(self.textureFile, self.textureFullPathDir)
+        self.secs = perf_counter() - startTime
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def resolve(self, getResult):
+        try:
+            getResult()
+        except:
+            ex = exc_info()
+            Logger.warn('Exception during copy of texture ' + self.textureName + ':\n\t\t\t\t\t'+ str(ex[1]), 4)
+            self.failed = True
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # waits for the job when not yet done, returning whether it succeeded
+    def result(self):
+        if self.future is not None:
+            future = self.future
+            self.future = None
+            self.resolve(future.result)
+
+        return not self.failed
+#===============================================================================
+# Scales a copy of the image, then writes its pixels through a generated image in the same format & colorspace, so
+# what is written is exactly the image's buffer (save_render would apply the scene's view transform & file settings).
+# Neither image is left in bpy.data.  When re-encoding, the generated image is written by write_reencoded_image().
+def write_scaled_image(image, width, height, filepath, reencode = None):
+    pixels = to_rgba(get_scaled_pixels(image, width, height))
+
+    output = bpy.data.images.new('bjs_scaled', width, height, alpha = True, float_buffer = image.is_float)
+    try:
+        output.colorspace_settings.name = image.colorspace_settings.name
+        write_pixels(output, pixels)
+        if reencode is not None:
+            write_reencoded_image(output, reencode, filepath)
+        else:
+            output.filepath_raw = filepath
+            output.file_format = image.file_format
+            output.save()
+    finally:
+        bpy.data.images.remove(output)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Writes an sRGB image in another format at a quality, reencode being (file format, quality).  Only save_render takes
+# a quality, so the scene's output format is borrowed, with an sRGB display & the view transform Standard, which is
+# the identity for sRGB images.  Where the output format can override color management (Blender 4+), it is made to
+# follow the scene.  Every scene setting changed is put back.
+def write_reencoded_image(image, reencode, filepath):
+    scene = bpy.context.scene
+    imageSettings = scene.render.image_settings
+    viewSettings = scene.view_settings
+    displaySettings = scene.display_settings
+    fileFormat, colorMode, quality = imageSettings.file_format, imageSettings.color_mode, imageSettings.quality
+    viewTransform, look, exposure, gamma = viewSettings.view_transform, viewSettings.look, viewSettings.exposure, viewSettings.gamma
+    displayDevice = displaySettings.display_device
+    colorManagement = imageSettings.color_management if hasattr(imageSettings, 'color_management') else None
+    try:
+        if colorManagement is not None:
+            imageSettings.color_management = 'FOLLOW_SCENE'
+        displaySettings.display_device = 'sRGB'
+        imageSettings.file_format = reencode[0]
+        imageSettings.color_mode = 'RGB'
+        imageSettings.quality = reencode[1]
+        viewSettings.view_transform = 'Standard'
+        viewSettings.look = 'None'
+        viewSettings.exposure = 0
+        viewSettings.gamma = 1
+        image.save_render(filepath, scene = scene)
+    finally:
+        imageSettings.file_format = fileFormat
+        imageSettings.color_mode = colorMode
+        imageSettings.quality = quality
+        displaySettings.display_device = displayDevice # before the view, whose choices depend on the display
+        viewSettings.view_transform = viewTransform
+        viewSettings.look = look
+        viewSettings.exposure = exposure
+        viewSettings.gamma = gamma
+        if colorManagement is not None:
+            imageSettings.color_management = colorManagement
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# returns the pixels of the image as a float array, one row per pixel, one column per channel of the image
+def read_pixels(image):
+    pixels = np.empty(len(image.pixels), dtype = np.float32)
+    if hasattr(image.pixels, 'foreach_get'): # Blender 2.83+
+        image.pixels.foreach_get(pixels)
+    else:
+        pixels[:] = image.pixels[:]
+    return pixels.reshape(-1, image.channels)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# the pixels at another size come from a scaled copy, never the image itself
+def get_scaled_pixels(image, width, height):
+    if tuple(image.size) == (width, height):
+        return read_pixels(image)
+
+    scaled = image.copy()
+    try:
+        scaled.scale(width, height)
+        return read_pixels(scaled)
+    finally:
+        bpy.data.images.remove(scaled)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# images in bpy.data always take 4 channels;  grayscale is spread to RGB, & alpha is opaque when missing
+def to_rgba(pixels):
+    channels = pixels.shape[1]
+    if channels == 4: return pixels
+
+    rgba = np.ones((len(pixels), 4), dtype = np.float32)
+    rgba[:, 0:3] = pixels[:, 0:3] if channels >= 3 else pixels[:, 0:1]
+    return rgba
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def write_pixels(image, pixels):
+    if hasattr(image.pixels, 'foreach_set'):
+        image.pixels.foreach_set(pixels.ravel())
+    else:
+        image.pixels[:] = pixels.ravel().tolist()
+#===============================================================================
+# Whether any pixel of the image is not fully opaque, rather than just whether its format could hold alpha.  Results
+# are cached by content hash for the export, since the same image is often used by many materials.
+def image_has_alpha(image):
+    # checks which need no pixels come first, so only images which must be scanned get hashed
+    if image.file_format in NON_ALPHA_FORMATS: return False
+    if image.alpha_mode == 'NONE' or image.channels < 4 or image.depth in NON_ALPHA_DEPTHS: return False
+
+    registry = TextureRegistry.instance
+    contentHash = registry.getImageHash(image)[1] if registry is not None else None
+    if contentHash is not None and contentHash in registry.alphaByHash:
+        return registry.alphaByHash[contentHash]
+
+    hasAlpha = scan_alpha(image)
+    if contentHash is not None:
+        registry.alphaByHash[contentHash] = hasAlpha
+    return hasAlpha
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Checked in chunks of rows, stopping at the first one with a pixel which is not opaque.  Blender 2.83+ reads every
+# value at once into a float32 buffer, which is still far smaller than the Python floats of image.pixels[:].  Earlier
+# versions read slices, so only a chunk is ever held as Python floats.
+def scan_alpha(image):
+    width, height = image.size
+    channels = image.channels
+    rowsPerChunk = max(1, ALPHA_SCAN_VALUES // max(1, width * channels))
+    try:
+        pixels = read_pixels(image) if hasattr(image.pixels, 'foreach_get') else None
+        for row in range(0, height, rowsPerChunk):
+            start = row * width
+            end = min(row + rowsPerChunk, height) * width
+            if pixels is not None:
+                alphas = pixels[start:end, 3]
+            else:
+                alphas = np.array(image.pixels[start * channels:end * channels], dtype = np.float32)[3::channels]
+
+            if (alphas < 1.0).any(): return True
+    except:
+        return True # could not be read, so stay with what the format allows
+
+    return False
 #===============================================================================
 class Texture:
     # called in constructor for BakeTexture, but for BJSImageTexture, called in Mesh, after ruling out will be baked
@@ -40,48 +544,136 @@ class Texture:
         # name of the texture without the extension, made into a legal js name, so load function can be written
         self.name = legal_js_identifier(self.fileNoPath.rpartition('.')[0])
 
-        # always write the file out, since base64 encoding is easiest from a file
-        try:
-            Logger.log('processing texture ' + self.name, 3)
+        # opaque PNGs can be written in a smaller format instead, when they hold colors, not data like normals
+        self.reencode = None
+        if canBeBase64 and settings.opaquePNGFormat != 'PNG' and self.image.file_format == 'PNG' and not self.hasAlpha:
+            if self.image.colorspace_settings.name == 'sRGB':
+                self.reencode = (settings.opaquePNGFormat, settings.reencodeQuality)
+                self.fileNoPath = self.fileNoPath.rpartition('.')[0] + REENCODE_EXTENSIONS[settings.opaquePNGFormat]
 
-            # when coming from either a packed image or a baked image, then save_render
-            if self.isInternalImage:
-                if inlineTextures:
-                    textureFile = path.join(textureFullPathDir, self.fileNoPath + 'temp')
+        # an environment texture is an HDR cube map, so not resized
+        sizing = TextureSizing.fromSettings(settings) if canBeBase64 else None
+
+        registry = TextureRegistry.instance
+        if registry is not None and TextureRegistry.canShare(self):
+            registry.process(self, textureFullPathDir, inlineTextures, sizing)
+        else:
+            self.write(textureFullPathDir, inlineTextures, sizing)
+
+        if bpyMesh:
+            self.map_to_mesh(bpyMesh)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def map_to_mesh(self, bpyMesh):
+        if not self.uvMapName or self.uvMapName == UV_ACTIVE_TEXTURE:  # only for image based & no node specifying
+            self.uvMapName = bpyMesh.data.uv_layers.active.name
+
+        Logger.log('texture type:  ' + self.textureType + ', mapped using: "' + self.uvMapName + '"', 4)
+        if bpyMesh.data.uv_layers[0].name == self.uvMapName:
+            self.coordinatesIndex = 0
+        elif bpyMesh.data.uv_layers[1].name == self.uvMapName:
+            self.coordinatesIndex = 1
+        else:
+            logging.Logger.warn('Texture is not mapped as UV or UV2, assigned 1', 5)
+            self.coordinatesIndex = 0
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # always write the file out, since base64 encoding is easiest from a file.  Only save_render, which calls bpy, is
+    # done here;  copying is queued as a TextureIOJob, waited on by to_json_file().  When inlining, only the file to
+    # encode is remembered, so the image is never held in memory.
+    def write(self, textureFullPathDir, inlineTextures, sizing = None):
+        filePath = self.image.filepath
+        self.ioJob = None
+        self.inlineFile = None
+        Logger.log('processing texture ' + self.name, 3)
+
+        width, height = self.image.size if sizing is not None else (0, 0)
+        targetSize = sizing.getTargetSize(width, height) if sizing is not None else None
+
+        # when the size or format must change, all outputs are from a scaled / re-encoded copy
+        if targetSize is not None or self.reencode is not None:
+            if inlineTextures:
+                textureFile = path.join(textureFullPathDir, self.fileNoPath + 'temp')
+            else:
+                textureFile = path.join(textureFullPathDir, self.fileNoPath)
+
+            try:
+                if targetSize is not None:
+                    width, height = targetSize
+                    Logger.log('scaled to ' + str(width) + 'x' + str(height), 4)
+                    write_scaled_image(self.image, width, height, textureFile, self.reencode)
                 else:
-                    textureFile = path.join(textureFullPathDir, self.fileNoPath)
-                self.image.save_render(textureFile)
+                    write_reencoded_image(self.image, self.reencode, textureFile)
 
-            # when backed by an actual file, copy to target dir, unless inlining
+                if self.reencode is not None:
+                    self.log_reencoding(textureFile)
+            except:
+                ex = exc_info()
+                Logger.warn('Exception during scaling / re-encoding:\n\t\t\t\t\t'+ str(ex[1]), 4)
+                return
+
+            if inlineTextures:
+                self.inlineFile = textureFile
+                if TextureRegistry.instance is not None:
+                    TextureRegistry.instance.tempFiles.append(textureFile)
+
+        # when coming from either a packed image or a baked image, then save_render
+        elif self.isInternalImage:
+            if inlineTextures:
+                textureFile = path.join(textureFullPathDir, self.fileNoPath + 'temp')
             else:
-                textureFile = bpy.path.abspath(filePath)
-                if not inlineTextures:
-                    copy(textureFile, textureFullPathDir)
-        except:
-            ex = exc_info()
-            Logger.warn('Exception during copy:\n\t\t\t\t\t'+ str(ex[1]), 4)
+                textureFile = path.join(textureFullPathDir, self.fileNoPath)
 
-        if inlineTextures:
-            # base64 is easiest from a file, so sometimes a temp file was made above;  need to delete those
-            with open(textureFile, "rb") as image_file:
-                asString = b64encode(image_file.read()).decode()
-            self.encoded_URI = 'data:image/' + self.image.file_format + ';base64,' + asString
+            try:
+                self.image.save_render(textureFile)
+            except:
+                ex = exc_info()
+                Logger.warn('Exception during copy:\n\t\t\t\t\t'+ str(ex[1]), 4)
+                return
 
-            if self.isInternalImage:
-                remove(textureFile)
+            # base64 is easiest from a file, so sometimes a temp file was made above;  need to delete those
+            if inlineTextures:
+                self.inlineFile = textureFile
+                if TextureRegistry.instance is not None:
+                    TextureRegistry.instance.tempFiles.append(textureFile)
 
-        if bpyMesh:
-            if not self.uvMapName or self.uvMapName == UV_ACTIVE_TEXTURE:  # only for image based & no node specifying
-                self.uvMapName = bpyMesh.data.uv_layers.active.name
-
-            Logger.log('texture type:  ' + self.textureType + ', mapped using: "' + self.uvMapName + '"', 4)
-            if bpyMesh.data.uv_layers[0].name == self.uvMapName:
-                self.coordinatesIndex = 0
-            elif bpyMesh.data.uv_layers[1].name == self.uvMapName:
-                self.coordinatesIndex = 1
+        # when backed by an actual file, copy to target dir, unless inlining
+        else:
+            textureFile = bpy.path.abspath(filePath)
+            if inlineTextures:
+                self.inlineFile = textureFile
             else:
-                logging.Logger.warn('Texture is not mapped as UV or UV2, assigned 1', 5)
-                self.coordinatesIndex = 0
+                self.ioJob = TextureIOJob(self.name, textureFile, textureFullPathDir)
+
+        # variants are only for loading files by device, so pointless when inlined
+        if sizing is not None and not inlineTextures:
+            for variantName, variantWidth, variantHeight in sizing.getVariants(self.fileNoPath, width, height):
+                try:
+                    Logger.log('variant ' + variantName + ' at ' + str(variantWidth) + 'x' + str(variantHeight), 4)
+                    write_scaled_image(self.image, variantWidth, variantHeight, path.join(textureFullPathDir, variantName), self.reencode)
+                except:
+                    ex = exc_info()
+                    Logger.warn('Exception during scaling:\n\t\t\t\t\t'+ str(ex[1]), 4)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def log_reencoding(self, textureFile):
+        originalSize = self.image.packed_file.size if self.image.packed_file else path.getsize(bpy.path.abspath(self.image.filepath))
+        savings = originalSize - path.getsize(textureFile)
+        Logger.log('opaque PNG re-encoded as ' + self.reencode[0] + ', saving ' + format_int(savings) + ' bytes', 4)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def getFileFormat(self):
+        return self.reencode[0] if self.reencode is not None else self.image.file_format
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # the data URI is base64 encoded in chunks straight from a memory map of the file into the output
+    def write_inline(self, file_handler):
+        file_handler.write(',"base64String":"data:image/' + self.getFileFormat() + ';base64,')
+        with open(self.inlineFile, 'rb') as image_file:
+            if path.getsize(self.inlineFile) > 0: # an empty file cannot be mapped
+                with mmap(image_file.fileno(), 0, access = ACCESS_READ) as mapped:
+                    for start in range(0, len(mapped), BASE64_CHUNK_SIZE):
+                        file_handler.write(b64encode(mapped[start:start + BASE64_CHUNK_SIZE]).decode())
+        file_handler.write('"')
+
+        # without a registry, nothing else can be sharing a temp file
+        if self.inlineFile.endswith('temp') and TextureRegistry.instance is None:
+            remove(self.inlineFile)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
         file_handler.write(', \n"' + self.textureType + '":{')
@@ -100,8 +692,10 @@ class Texture:
         write_int(file_handler, 'wrapU', self.wrapU)
         write_int(file_handler, 'wrapV', self.wrapV)
         write_int(file_handler, 'coordinatesIndex', self.coordinatesIndex)
-        if hasattr(self,'encoded_URI'):
-            write_string(file_handler, 'base64String', self.encoded_URI)
+        if hasattr(self,'ioJob') and self.ioJob is not None:
+            self.ioJob.result()
+        if hasattr(self,'inlineFile') and self.inlineFile is not None:
+            self.write_inline(file_handler)
         file_handler.write('}')
 #===============================================================================
 class BakedTexture(Texture):
@@ -129,6 +723,137 @@ class BakedTexture(Texture):
         self.uvMapName = bakedMaterial.uvMapName
         self.process(bakedMaterial.textureFullPathDir, True, bpyMesh)
 #===============================================================================
+# Ambient occlusion, roughness & metallic from separate images, packed into one texture in the layout Babylon expects:
+# AO in red, roughness in green & metal in blue.  The channel in that position of each source is taken, which is right
+# for both grayscale maps & images already packed.  Channels without a source are white.  Packed files are shared for
+# the export by the hashes of their inputs, & skipped when still the same as a prior export wrote.
+class PackedMetallicTexture(Texture):
+    def __init__(self, materialName, sources, textureFullPathDir, bpyMesh): # sources [AO, roughness, metal], None when absent
+        self.textureType = METAL_TEX
+
+        # super class does not have a constructor;  mapping is from the first source, haveSameMapping() being checked
+        first = next(tex for tex in sources if tex is not None)
+        self.image = None
+        self.isInternalImage = True
+        self.hasAlpha = False
+        self.level = 1
+        self.coordinatesMode = first.coordinatesMode
+        self.uOffset = first.uOffset
+        self.vOffset = first.vOffset
+        self.uScale  = first.uScale
+        self.vScale  = first.vScale
+        self.uAng    = first.uAng
+        self.vAng    = first.vAng
+        self.wAng    = first.wAng
+        self.wrapU = first.wrapU
+        self.wrapV = first.wrapV
+        self.uvMapName = first.uvMapName
+        self.reencode = None
+        self.ioJob = None
+        self.inlineFile = None
+        self.failed = False # when set, the material uses the sources instead
+        self.map_to_mesh(bpyMesh)
+
+        settings = bpy.context.scene.world
+        inlineTextures = settings.inlineTextures
+        images = [tex.image if tex is not None else None for tex in sources]
+
+        # the largest source decides the size, still subject to the export's limits
+        width  = max(image.size[0] for image in images if image is not None)
+        height = max(image.size[1] for image in images if image is not None)
+        sizing = TextureSizing.fromSettings(settings)
+        targetSize = sizing.getTargetSize(width, height) if sizing is not None else None
+        if targetSize is not None:
+            width, height = targetSize
+
+        registry = TextureRegistry.instance
+        hashes = [registry.getImageHash(image)[1] if image is not None else '' for image in images] if registry is not None else [None]
+        cacheable = None not in hashes
+        if cacheable:
+            key = (tuple(hashes), width, height, inlineTextures)
+            known = registry.packedByKey.get(key)
+            if known is not None:
+                self.fileNoPath, self.name, self.inlineFile = known
+                Logger.log('packed metallic texture shared:  ' + self.name, 3)
+                return
+
+            combinedHash = sha1(('|'.join(hashes) + '|' + str(width) + 'x' + str(height)).encode()).hexdigest()
+
+        # legal_js_identifier() can make the names of different materials the same, e.g. 'Mat.001' & 'Mat_001', so a
+        # hash of what is packed keeps the file names apart
+        suffix = combinedHash if cacheable else sha1(materialName.encode()).hexdigest()
+        self.name = legal_js_identifier(materialName) + '_ORM_' + suffix[:8]
+        self.fileNoPath = self.name + '.png'
+        textureFile = path.join(textureFullPathDir, self.fileNoPath + ('temp' if inlineTextures else ''))
+
+        # variants are only for loading files by device, so pointless when inlined
+        variants = sizing.getVariants(self.fileNoPath, width, height) if sizing is not None and not inlineTextures else []
+        variantNames = [variantName for variantName, variantWidth, variantHeight in variants]
+
+        if not inlineTextures and cacheable and registry.manifest.isUpToDate(self.fileNoPath, combinedHash, '', variantNames):
+            Logger.log('packed metallic texture ' + self.name + ' up to date from prior export', 3)
+        else:
+            try:
+                Logger.log('packing metallic texture ' + self.name + ' at ' + str(width) + 'x' + str(height), 3)
+                write_packed_image(images, width, height, textureFile)
+            except:
+                ex = exc_info()
+                Logger.warn('Exception during packing, sources used instead:\n\t\t\t\t\t'+ str(ex[1]), 4)
+                self.failed = True
+                return # nothing to inline, & not to be shared
+
+            for variantName, variantWidth, variantHeight in variants:
+                try:
+                    Logger.log('variant ' + variantName + ' at ' + str(variantWidth) + 'x' + str(variantHeight), 4)
+                    write_packed_image(images, variantWidth, variantHeight, path.join(textureFullPathDir, variantName))
+                except:
+                    ex = exc_info()
+                    Logger.warn('Exception during packing:\n\t\t\t\t\t'+ str(ex[1]), 4)
+
+            # a missing variant fails isUpToDate() next time, so is then re-written
+            if not inlineTextures and cacheable:
+                registry.manifest.record(self.fileNoPath, ('ORM:' + self.name, None, None), combinedHash, 0, '', variantNames)
+
+        if inlineTextures:
+            self.inlineFile = textureFile
+            if registry is not None:
+                registry.tempFiles.append(textureFile)
+
+        if cacheable:
+            registry.packedByKey[key] = (self.fileNoPath, self.name, self.inlineFile)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # packed channels share one set of coordinates, so sources can only be packed when mapped the same way
+    @staticmethod
+    def haveSameMapping(sources):
+        mappings = set(PackedMetallicTexture.getMapping(tex) for tex in sources if tex is not None)
+        return len(mappings) == 1
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def getMapping(tex):
+        uvMapName = None if not tex.uvMapName or tex.uvMapName == UV_ACTIVE_TEXTURE else tex.uvMapName
+        return (uvMapName, tex.coordinatesMode, tex.uOffset, tex.vOffset, tex.uScale, tex.vScale, tex.uAng, tex.vAng, tex.wAng, tex.wrapU, tex.wrapV)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def getFileFormat(self):
+        return 'PNG'
+#===============================================================================
+# the packed data is written through a generated, non-color image, so the values are saved exactly
+def write_packed_image(images, width, height, filepath):
+    packed = np.ones((width * height, 4), dtype = np.float32)
+    for channel, image in enumerate(images):
+        if image is not None:
+            pixels = get_scaled_pixels(image, width, height)
+            packed[:, channel] = pixels[:, min(channel, pixels.shape[1] - 1)]
+
+    output = bpy.data.images.new('bjs_packed', width, height, alpha = False, float_buffer = False)
+    try:
+        output.colorspace_settings.name = 'Non-Color'
+        write_pixels(output, packed)
+        output.filepath_raw = filepath
+        output.file_format = 'PNG'
+        output.save()
+    finally:
+        bpy.data.images.remove(output)
+#===============================================================================
 class BJSImageTexture(Texture):
     def __init__(self, bjsImageNode, isForEnvironment = False):
         # super class does not have a constructor
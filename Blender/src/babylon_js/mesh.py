@@ -4,14 +4,20 @@ from .package_level import *
 from .f_curve_animatable import *
 from .armature import *
 from .shape_key_group import *
+from .world import TRIANGULATE_BMESH
 
 from .materials.material import *
 from .materials.baking_recipe import *
 
 import bpy
 import math
+from array import array
+from io import StringIO
 from mathutils import Vector, Quaternion
+from os import SEEK_END
 from random import randint
+from tempfile import TemporaryFile
+from time import perf_counter
 
 # used in Mesh & Node constructors, defined in BABYLON.AbstractMesh; strings so can be value part of EnumProperty
 BILLBOARDMODE_NONE = '0'
@@ -36,12 +42,21 @@ ZERO_V = Vector((0, 0, 0))
 ZERO_Q = Quaternion((1, 0, 0, 0))
 #===============================================================================
 class Mesh(FCurveAnimatable):
+    # many members are optional & tested with hasattr(), so are only assigned when needed
+    __slots__ = ('scene', 'name', 'isVisible', 'isPickable', 'isEnabled', 'checkCollisions', 'receiveShadows', 'castShadows',
+                 'billboardMode', 'freezeWorldMatrix', 'layer', 'tags', 'lockedTargetId', 'hasSkeleton', 'skeleton', 'skeletonId',
+                 'position', 'rotation', 'rotationQuaternion', 'scaling', 'hasUnappliedTransforms', 'dataName', 'parentId',
+                 'physicsImpostor', 'physicsMass', 'physicsFriction', 'physicsRestitution', 'instances', 'materialId',
+                 'positions', 'normals', 'uvs', 'uvs2', 'colors', 'indices', 'subMeshes',
+                 'numBoneInfluencers', 'skeletonWeights', 'skeletonIndices', 'skeletonWeightsExtra', 'skeletonIndicesExtra',
+                 'rawShapeKeys', 'morphTargetManagerId', 'shapeKeyGroups', 'alreadyExported', 'spillRecord', 'morphSpillRecord')
+
     def __init__(self, bpyMesh, scene, exporter):
         self.scene = scene
         self.name = bpyMesh.name
         Logger.log('processing begun of mesh:  ' + self.name)
-        self.define_animations(bpyMesh, True, True, True)  #Should animations be done when forcedParent
 
+        # only what an instance also needs is done before it is known whether this is one
         self.isVisible = bpyMesh.visible_get()
         self.isPickable = not bpyMesh.hide_select
         self.isEnabled = not bpyMesh.hide_render
@@ -53,12 +68,6 @@ class Mesh(FCurveAnimatable):
         self.layer = getLayer(bpyMesh) # used only for lights with 'This Layer Only' checked, not exported
         self.tags = bpyMesh.data.tags
 
-        # Constraints
-        for constraint in bpyMesh.constraints:
-            if constraint.type == 'TRACK_TO':
-                self.lockedTargetId = constraint.target.name # does not support; 'to', 'up', 'space' or 'influence'
-                break
-
         # hasSkeleton detection & skeletonID determination
         self.hasSkeleton = False
         objArmature = None      # if there's an armature, this will be the one!
@@ -141,6 +150,14 @@ class Mesh(FCurveAnimatable):
         else:
             self.instances = []
 
+        self.define_animations(bpyMesh, True, True, True)  #Should animations be done when forcedParent
+
+        # Constraints
+        for constraint in bpyMesh.constraints:
+            if constraint.type == 'TRACK_TO':
+                self.lockedTargetId = constraint.target.name # does not support; 'to', 'up', 'space' or 'influence'
+                break
+
         # process all of the materials required
         recipe = BakingRecipe(bpyMesh, exporter)
 
@@ -153,7 +170,7 @@ class Mesh(FCurveAnimatable):
                 if (exporter.getMaterial(mat.name) != None):
                     Logger.log('registered as also a user of material:  ' + mat.name, 2)
                 else:
-                    exporter.materials.append(mat)
+                    exporter.register_material(mat)
                     mat.processImageTextures(bpyMesh)
 
             if len(recipe.bjsMaterials) == 1:
@@ -166,19 +183,23 @@ class Mesh(FCurveAnimatable):
             else:
                 Logger.warn('No materials have been assigned: ', 2)
 
-        # Get mesh temporary version of mesh with modifiers applied
-        mesh = bpyMesh.to_mesh(bpy.context.depsgraph, True)
+        # Get mesh temporary version of mesh with modifiers applied; released as soon as extraction is done
+        mesh = exporter.get_temp_mesh(bpyMesh)
 
         # Triangulate mesh if required
-        Mesh.mesh_triangulate(mesh)
-
-        # Getting vertices and indices
-        self.positions  = []
-        self.normals    = []
-        self.uvs        = [] # not always used
-        self.uvs2       = [] # not always used
-        self.colors     = [] # not always used
-        self.indices    = []
+        startTime = perf_counter()
+        Mesh.mesh_triangulate(mesh, scene.world.triangulation == TRIANGULATE_BMESH)
+        elapsed = perf_counter() - startTime
+        exporter.triangulationTime += elapsed
+        Logger.log('triangulation      :  ' + format_f(elapsed) + ' secs', 2)
+
+        # Getting vertices and indices; typed arrays, since these can be very large & are held until the file is written
+        self.positions  = array('f') # x, y, z of each vertex
+        self.normals    = array('f') # x, y, z of each vertex
+        self.uvs        = array('f') # not always used
+        self.uvs2       = array('f') # not always used
+        self.colors     = array('f') # not always used
+        self.indices    = array('I')
         self.subMeshes  = []
 
         hasUV = len(mesh.uv_layers) > 0
@@ -223,6 +244,9 @@ class Mesh(FCurveAnimatable):
         vertices_sk_weights = []
         vertices_sk_indices = []
 
+        # bone index of each vertex group, or None when the group is not a bone; filled as groups are encountered
+        boneIndexOfGroup = {}
+
         for v in range(len(mesh.vertices)):
             alreadySavedVertices.append(False)
             vertices_Normals.append([])
@@ -271,10 +295,14 @@ class Mesh(FCurveAnimatable):
                             index = group.group
                             weight = group.weight
 
-                            for bone in objArmature.pose.bones:
-                                if bpyMesh.vertex_groups[index].name == bone.name:
-                                    matricesWeights.append(weight)
-                                    matricesIndices.append(self.skeleton.get_index_of_bone(bone.name))
+                            if index not in boneIndexOfGroup:
+                                groupName = bpyMesh.vertex_groups[index].name
+                                boneIndexOfGroup[index] = self.skeleton.get_index_of_bone(groupName) if groupName in objArmature.pose.bones else None
+
+                            boneIndex = boneIndexOfGroup[index]
+                            if boneIndex is not None:
+                                matricesWeights.append(weight)
+                                matricesIndices.append(boneIndex)
 
                     # Texture coordinates
                     if hasUV:
@@ -335,7 +363,7 @@ class Mesh(FCurveAnimatable):
                         alreadySavedVertices[vertex_index] = True
 
                         vertices_Normals[vertex_index].append(normal)
-                        self.normals.append(normal)
+                        self.normals.extend(normal)
 
                         if hasUV:
                             vertices_UVs[vertex_index].append(vertex_UV)
@@ -365,21 +393,23 @@ class Mesh(FCurveAnimatable):
                             indicesPerVertex.append(matricesIndices)
 
                         if hasShapeKeys:
-                            keyOrderMap.append([vertex_index, len(self.positions)]) # use len positions before it is append to convert from 1 to 0 origin
+                            keyOrderMap.append([vertex_index, verticesCount]) # use count before it is incremented to convert from 1 to 0 origin
 
                         vertices_indices[vertex_index].append(index)
 
-                        self.positions.append(position)
+                        self.positions.extend(position)
 
                         verticesCount += 1
                     self.indices.append(index)
                     indicesCount += 1
             self.subMeshes.append(SubMesh(materialIndex, subMeshVerticesStart, subMeshIndexStart, verticesCount - subMeshVerticesStart, indicesCount - subMeshIndexStart))
 
+        # nothing from the temporary mesh is referenced past here, everything was copied into arrays
+        exporter.release_temp_mesh(mesh)
         BJSMaterial.meshBakingClean(bpyMesh)
 
-        Logger.log('num positions      :  ' + str(len(self.positions)), 2)
-        Logger.log('num normals        :  ' + str(len(self.normals  )), 2)
+        Logger.log('num positions      :  ' + str(verticesCount), 2)
+        Logger.log('num normals        :  ' + str(verticesCount), 2)
         Logger.log('num uvs            :  ' + str(len(self.uvs      )), 2)
         Logger.log('num uvs2           :  ' + str(len(self.uvs2     )), 2)
         Logger.log('num colors         :  ' + str(len(self.colors   )), 2)
@@ -394,8 +424,8 @@ class Mesh(FCurveAnimatable):
                 self.skeletonIndicesExtra = Mesh.packSkeletonIndices(self.skeletonIndicesExtra)
 
             Logger.log('Total Influencers:  ' + format_f(totalInfluencers), 3)
-            if len(self.positions) > 0:
-                Logger.log('Avg # of influencers per vertex:  ' + format_f(totalInfluencers / len(self.positions)), 3)
+            if verticesCount > 0:
+                Logger.log('Avg # of influencers per vertex:  ' + format_f(totalInfluencers / verticesCount), 3)
             Logger.log('Highest # of influencers observed:  ' + str(highestInfluenceObserved) + ', num vertices with this:  ' + format_int(influenceCounts[highestInfluenceObserved if highestInfluenceObserved < 9 else 0]), 3)
             Logger.log('exported as ' + str(self.numBoneInfluencers) + ' influencers', 3)
             nWeights = len(self.skeletonWeights) + (len(self.skeletonWeightsExtra) if hasattr(self, 'skeletonWeightsExtra') else 0)
@@ -405,6 +435,8 @@ class Mesh(FCurveAnimatable):
         if numZeroAreaFaces > 0:
             Logger.warn('# of 0 area faces found:  ' + str(numZeroAreaFaces), 2)
 
+        Logger.log('geometry bytes     :  ' + str(self.get_geometry_bytes()), 2)
+
         # shape keys for mesh
         if hasShapeKeys:
             Mesh.sort(keyOrderMap)
@@ -456,13 +488,27 @@ class Mesh(FCurveAnimatable):
         nZeroAreaFaces = 0
         for f in range(nFaces):
             faceOffset = f * 3
-            p1 = self.positions[self.indices[faceOffset    ]]
-            p2 = self.positions[self.indices[faceOffset + 1]]
-            p3 = self.positions[self.indices[faceOffset + 2]]
+            p1 = self.get_position(self.indices[faceOffset    ])
+            p2 = self.get_position(self.indices[faceOffset + 1])
+            p3 = self.get_position(self.indices[faceOffset + 2])
 
-            if same_vertex(p1, p2) or same_vertex(p1, p3) or same_vertex(p2, p3): nZeroAreaFaces += 1
+            if same_array(p1, p2) or same_array(p1, p3) or same_array(p2, p3): nZeroAreaFaces += 1
 
         return nZeroAreaFaces
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get_position(self, vertexIndex):
+        offset = vertexIndex * 3
+        return self.positions[offset : offset + 3]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # bytes held by the per vertex / index arrays, for the memory report; 0 once spilled
+    def get_geometry_bytes(self):
+        nBytes = 0
+        for attr in ('positions', 'normals', 'uvs', 'uvs2', 'colors', 'indices', 'skeletonWeights', 'skeletonIndices', 'skeletonWeightsExtra', 'skeletonIndicesExtra'):
+            if hasattr(self, attr):
+                values = getattr(self, attr)
+                nBytes += len(values) * values.itemsize
+
+        return nBytes
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     @staticmethod
     # ShapeKeyGroup depends on AffectedIndices being in asending order, so sort it, probably nothing to do
@@ -477,22 +523,26 @@ class Mesh(FCurveAnimatable):
                     keyOrderMap[idx - 1] = tmp
                     notSorted = True
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # loop_triangles are always what is read; the BMesh round trip only changes how they are split, at the cost of a full copy
     @staticmethod
-    def mesh_triangulate(mesh):
-        try:
-            import bmesh
-            bm = bmesh.new()
-            bm.from_mesh(mesh)
-            bmesh.ops.triangulate(bm, faces = bm.faces)
-            bm.to_mesh(mesh)
-            mesh.calc_loop_triangles()
-            if mesh.has_custom_normals:
-                mesh.calc_normals_split()
-                Logger.log('Custom split normals being used', 2)
-
-            bm.free()
-        except:
-            pass
+    def mesh_triangulate(mesh, useBMesh):
+        if useBMesh:
+            try:
+                import bmesh
+                bm = bmesh.new()
+                try:
+                    bm.from_mesh(mesh)
+                    bmesh.ops.triangulate(bm, faces = bm.faces)
+                    bm.to_mesh(mesh)
+                finally:
+                    bm.free()
+            except Exception as ex:
+                Logger.warn('BMesh triangulation failed, using loop triangles of un-triangulated mesh:  ' + str(ex), 2)
+
+        mesh.calc_loop_triangles()
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            Logger.log('Custom split normals being used', 2)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def toFixedInfluencers(self, weightsPerVertex, indicesPerVertex, maxInfluencers, highestObserved):
         if (maxInfluencers > 8 or maxInfluencers < 1):
@@ -504,11 +554,11 @@ class Mesh(FCurveAnimatable):
 
         maxInfluencersExceeded = 0
 
-        fixedWeights = []
-        fixedIndices = []
+        fixedWeights = array('f')
+        fixedIndices = array('I')
 
-        fixedWeightsExtra = []
-        fixedIndicesExtra = []
+        fixedWeightsExtra = array('f')
+        fixedIndicesExtra = array('I')
 
         for i in range(len(weightsPerVertex)):
             weights = weightsPerVertex[i]
@@ -560,7 +610,7 @@ class Mesh(FCurveAnimatable):
     # assume that toFixedInfluencers has already run, which ensures indices length is a multiple of 4
     @staticmethod
     def packSkeletonIndices(indices):
-        compressedIndices = []
+        compressedIndices = array('I')
 
         for i in range(math.floor(len(indices) / 4)):
             idx = i * 4
@@ -572,8 +622,49 @@ class Mesh(FCurveAnimatable):
             compressedIndices.append(matricesIndicesCompressed)
 
         return compressedIndices
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # write everything which is final once the constructor completes to the spill file, then release the geometry.
+    # Only what later passes use (name, position, castShadows, instances, etc) stays in memory.
+    def spill(self, spillFile):
+        self.spillRecord = spillFile.spill(self.write_geometry)
+        if hasattr(self, 'morphTargetManagerId'):
+            self.morphSpillRecord = spillFile.spill(self.write_morphing_file)
+
+        for attr in ('positions', 'normals', 'uvs', 'uvs2', 'colors', 'indices', 'subMeshes', 'skeletonWeights', 'skeletonIndices',
+                     'skeletonWeightsExtra', 'skeletonIndicesExtra', 'rawShapeKeys', 'shapeKeyGroups'):
+            if hasattr(self, attr):
+                delattr(self, attr)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def to_json_file(self, file_handler):
+        if hasattr(self, 'spillRecord'):
+            MeshSpillFile.instance.copy_to(file_handler, self.spillRecord)
+        else:
+            self.write_geometry(file_handler)
+
+        super().to_json_file(file_handler) # Animations
+
+        # Instances
+        first = True
+        file_handler.write('\n,"instances":[')
+        for instance in self.instances:
+            if first == False:
+                file_handler.write(',')
+
+            instance.to_json_file(file_handler)
+
+            first = False
+        file_handler.write(']')
+
+        # Shape Keys
+        if hasattr(self, 'morphTargetManagerId'):
+            write_int(file_handler, 'morphTargetManagerId', self.morphTargetManagerId)
+
+        # Close mesh
+        file_handler.write('}\n')
+        self.alreadyExported = True
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # everything up to the animations, which is known once the constructor completes
+    def write_geometry(self, file_handler):
         file_handler.write('{')
         write_string(file_handler, 'name', self.name, True)
         write_string(file_handler, 'id', self.name)
@@ -609,8 +700,8 @@ class Mesh(FCurveAnimatable):
             write_int(file_handler, 'skeletonId', self.skeletonId)
             write_int(file_handler, 'numBoneInfluencers', self.numBoneInfluencers)
 
-        write_vector_array(file_handler, 'positions', self.positions, world.positionsPrecision)
-        write_vector_array(file_handler, 'normals'  , self.normals, world.normalsPrecision)
+        write_packed_vector_array(file_handler, 'positions', self.positions, world.positionsPrecision)
+        write_packed_vector_array(file_handler, 'normals'  , self.normals, world.normalsPrecision)
 
         if len(self.uvs) > 0:
             write_array(file_handler, 'uvs', self.uvs, world.UVsPrecision)
@@ -646,30 +737,12 @@ class Mesh(FCurveAnimatable):
             subMesh.to_json_file(file_handler)
             first = False
         file_handler.write(']')
-
-        super().to_json_file(file_handler) # Animations
-
-        # Instances
-        first = True
-        file_handler.write('\n,"instances":[')
-        for instance in self.instances:
-            if first == False:
-                file_handler.write(',')
-
-            instance.to_json_file(file_handler)
-
-            first = False
-        file_handler.write(']')
-
-        # Shape Keys
-        if hasattr(self, 'morphTargetManagerId'):
-            write_int(file_handler, 'morphTargetManagerId', self.morphTargetManagerId)
-
-        # Close mesh
-        file_handler.write('}\n')
-        self.alreadyExported = True
 #===============================================================================
     def write_morphing_file(self, file_handler):
+        if hasattr(self, 'morphSpillRecord'):
+            MeshSpillFile.instance.copy_to(file_handler, self.morphSpillRecord)
+            return
+
         first = True
         file_handler.write('{')
         write_int(file_handler, 'id', self.morphTargetManagerId, True)
@@ -684,6 +757,9 @@ class Mesh(FCurveAnimatable):
         file_handler.write(']}')
 #===============================================================================
 class MeshInstance:
+     __slots__ = ('name', 'parentId', 'position', 'rotation', 'rotationQuaternion', 'scaling', 'freezeWorldMatrix', 'tags',
+                  'checkCollisions', 'isPickable', 'physicsImpostor', 'physicsMass', 'physicsFriction', 'physicsRestitution')
+
      def __init__(self, instancedMesh, rotation, rotationQuaternion):
         self.name = instancedMesh.name
         if hasattr(instancedMesh, 'parentId'): self.parentId = instancedMesh.parentId
@@ -730,6 +806,9 @@ class MeshInstance:
         file_handler.write('}')
 #===============================================================================
 class Node(FCurveAnimatable):
+    __slots__ = ('name', 'parentId', 'position', 'rotation', 'rotationQuaternion', 'scaling', 'isVisible', 'isEnabled',
+                 'checkCollisions', 'billboardMode', 'castShadows', 'receiveShadows', 'tags', 'layer')
+
     def __init__(self, node):
         Logger.log('processing begun of node:  ' + node.name)
         self.define_animations(node, True, True, True)  #Should animations be done when forcedParent
@@ -778,6 +857,8 @@ class Node(FCurveAnimatable):
         file_handler.write('}')
 #===============================================================================
 class SubMesh:
+    __slots__ = ('materialIndex', 'verticesStart', 'indexStart', 'verticesCount', 'indexCount')
+
     def __init__(self, materialIndex, verticesStart, indexStart, verticesCount, indexCount):
         self.materialIndex = materialIndex
         self.verticesStart = verticesStart
@@ -794,6 +875,36 @@ class SubMesh:
         write_int(file_handler, 'indexCount'   , self.indexCount)
         file_handler.write('}')
 #===============================================================================
+# temporary file holding the JSON of meshes already processed, so their geometry can be released early
+class MeshSpillFile:
+    instance = None
+
+    def __init__(self):
+        self.file_handler = TemporaryFile() # binary, deleted on close
+        self.nBytes = 0
+
+        # allow Mesh to find it without it being passed
+        MeshSpillFile.instance = self
+
+    # returns the record (offset, length) needed to copy the fragment back out
+    def spill(self, writer):
+        buffer = StringIO() # only ever as large as one mesh
+        writer(buffer)
+        data = buffer.getvalue().encode('utf8')
+
+        offset = self.file_handler.seek(0, SEEK_END)
+        self.file_handler.write(data)
+        self.nBytes += len(data)
+        return (offset, len(data))
+
+    def copy_to(self, file_handler, record):
+        self.file_handler.seek(record[0])
+        file_handler.write(self.file_handler.read(record[1]).decode('utf8'))
+
+    def close(self):
+        self.file_handler.close()
+        MeshSpillFile.instance = None
+#===============================================================================
 bpy.types.Mesh.autoAnimate = bpy.props.BoolProperty(
     name='Auto launch animations',
     description='',
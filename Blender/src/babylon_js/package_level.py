@@ -4,6 +4,7 @@ from mathutils import Euler, Matrix
 
 from bpy import app
 from time import strftime
+import numpy as np
 FLOAT_PRECISION_DEFAULT = 4
 VERTEX_OUTPUT_PER_LINE = 50
 STRIP_LEADING_ZEROS_DEFAULT = False # false for .babylon
@@ -112,6 +113,12 @@ def format_float(num, fmt, stripLeadingZero = STRIP_LEADING_ZEROS_DEFAULT):
 
     return s
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# format_float for every element of a numpy array at once, returns an array of strings of the same shape
+def format_float_array(array, precision = FLOAT_PRECISION_DEFAULT):
+    s = np.char.mod('%.' + str(precision) + 'f', array)
+    s = np.char.rstrip(np.char.rstrip(s, '0'), '.')
+    return np.where(s == '-0', '0', s)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def format_matrix4(matrix, precision = FLOAT_PRECISION_DEFAULT):
     tempMatrix = matrix.copy()
     tempMatrix.transpose()
@@ -180,6 +187,26 @@ def format_vector_array(vectorArray, precision = FLOAT_PRECISION_DEFAULT, indent
 
     return ret
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# same output as format_vector_array, but for a flat array of x, y, z values, e.g. array('f')
+def format_packed_vector_array(packedArray, precision = FLOAT_PRECISION_DEFAULT, indent = ''):
+    ret = ''
+    first = True
+    nOnLine = 0
+    fmt = '%.' + str(precision) + 'f'
+    for idx in range(0, len(packedArray) - 2, 3):
+        if (first != True):
+            ret +=','
+        first = False;
+
+        ret += format_float(packedArray[idx], fmt) + ',' + format_float(packedArray[idx + 2], fmt) + ',' + format_float(packedArray[idx + 1], fmt)
+        nOnLine += 3
+
+        if nOnLine >= VERTEX_OUTPUT_PER_LINE:
+            ret += '\n' + indent
+            nOnLine = 0
+
+    return ret
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def format_quaternion(quaternion, precision = FLOAT_PRECISION_DEFAULT):
     fmt = '%.' + str(precision) + 'f'
     return format_float(quaternion.x, fmt) + ',' + format_float(quaternion.z, fmt) + ',' + format_float(quaternion.y, fmt) + ',' + format_float(-quaternion.w, fmt)
@@ -284,6 +311,9 @@ def write_vector(file_handler, name, vector, precision = FLOAT_PRECISION_DEFAULT
 def write_vector_array(file_handler, name, vectorArray, precision = FLOAT_PRECISION_DEFAULT):
     file_handler.write('\n,"' + name + '":[' + format_vector_array(vectorArray, precision, '') + ']')
 
+def write_packed_vector_array(file_handler, name, packedArray, precision = FLOAT_PRECISION_DEFAULT):
+    file_handler.write('\n,"' + name + '":[' + format_packed_vector_array(packedArray, precision, '') + ']')
+
 def write_quaternion(file_handler, name, quaternion, precision = FLOAT_PRECISION_DEFAULT):
     file_handler.write(',"' + name  +'":[' + format_quaternion(quaternion, precision) + ']')
 
@@ -19,6 +19,10 @@ ENV_SZ_1 = "128"
 ENV_SZ_2 = "256"
 ENV_SZ_3 = "512"
 
+# used by Mesh constructor
+TRIANGULATE_LOOP_TRIANGLES = 'LOOP_TRIANGLES'
+TRIANGULATE_BMESH = 'BMESH'
+
 #===============================================================================
 class World:
     def __init__(self, scene):
@@ -140,6 +144,21 @@ bpy.types.World.mWeightsPrecision = bpy.props.IntProperty(
     default = 2, min = 1, max = 5
 )
 
+###     Meshes     ###
+bpy.types.World.spillMeshes = bpy.props.BoolProperty(
+    name='Low Memory Mesh Export',
+    description='Write each mesh to a temporary file as soon as it is processed, & release its geometry.\nPeak memory then depends on the largest mesh, not the whole scene',
+    default = False
+)
+bpy.types.World.triangulation = bpy.props.EnumProperty(
+    name='Triangulation',
+    description='How faces with more than 3 sides are split into triangles',
+    items = ((TRIANGULATE_BMESH         , 'BMesh'         , 'Triangulate a BMesh copy of each mesh {default}'),
+             (TRIANGULATE_LOOP_TRIANGLES, 'Loop Triangles', 'Use the triangles Blender already has for drawing.  Faster, no extra copy of the mesh')
+            ),
+    default = TRIANGULATE_BMESH
+)
+
 ###     Textures / Materials     ###
 bpy.types.World.inlineTextures = bpy.props.BoolProperty(
     name='inline',
@@ -151,6 +170,38 @@ bpy.types.World.textureDir = bpy.props.StringProperty(
     description='The path below the output directory to write texture files (any separators OS dependent)',
     default = ''
 )
+bpy.types.World.maxTextureSize = bpy.props.IntProperty(
+    name='Max Size',
+    description='Largest width or height of a texture written.  Larger images are scaled down on a copy, the\noriginal image is not changed.  0 for no limit.  Does not apply to environment texture.',
+    default = 0, min = 0, max = 16384
+)
+bpy.types.World.powerOfTwoTextures = bpy.props.BoolProperty(
+    name='Power of 2 Sizes',
+    description='Scale textures to the nearest power of 2 width & height, not exceeding Max Size',
+    default = False
+)
+bpy.types.World.textureVariants = bpy.props.BoolProperty(
+    name='Half & Quarter Variants',
+    description='Also write _half & _quarter resolution files of each texture, for device adaptive loading.\nNot for inline textures.',
+    default = False
+)
+# WebP can only be offered when this version of Blender can write it
+OPAQUE_PNG_FORMATS = [('PNG' , 'Keep PNG', 'Opaque PNGs are written unchanged'),
+                      ('JPEG', 'JPEG'    , 'PNGs without any transparent pixel are written as JPEG')]
+if 'WEBP' in bpy.types.ImageFormatSettings.bl_rna.properties['file_format'].enum_items.keys():
+    OPAQUE_PNG_FORMATS.append(('WEBP', 'WebP', 'PNGs without any transparent pixel are written as WebP'))
+
+bpy.types.World.opaquePNGFormat = bpy.props.EnumProperty(
+    name='Opaque PNGs',
+    description='Format to write color PNGs which turn out to have no transparent pixels.  Normal & other\nnon-color maps are always kept as is.',
+    items = OPAQUE_PNG_FORMATS,
+    default = 'PNG'
+)
+bpy.types.World.reencodeQuality = bpy.props.IntProperty(
+    name='Quality',
+    description='Quality of opaque PNGs re-encoded',
+    default = 85, min = 1, max = 100
+)
 bpy.types.World.usePBRMaterials = bpy.props.BoolProperty(
     name='Use PBR Materials',
     description="Export as a PBR materials, when checked",
@@ -185,6 +236,51 @@ bpy.types.World.autoAnimate = bpy.props.BoolProperty(
     description='Start all animations, except for bones.',
     default = False
 )
+bpy.types.World.reduceKeyframes = bpy.props.BoolProperty(
+    name='Reduce Key Frames',
+    description='Remove keys which interpolation of the keys kept rebuilds within the tolerances below.\nAnimations which never move are removed.  Bone matrices are only reduced when also opted into below',
+    default = False,
+)
+bpy.types.World.reduceBoneMatrices = bpy.props.BoolProperty(
+    name='Also Reduce Bone Matrices',
+    description='Remove keys of bone matrix animations too.  Matrices are not interpolated by default, so bones snap\nbetween the keys kept, unless BABYLON.Animation.AllowMatricesInterpolation = true',
+    default = False,
+)
+bpy.types.World.positionTolerance = bpy.props.FloatProperty(
+    name='Position Tolerance',
+    description='Max difference in position allowed, when removing keys',
+    default = 0.001, min = 0, precision = 4
+)
+bpy.types.World.rotationTolerance = bpy.props.FloatProperty(
+    name='Rotation Tolerance',
+    description='Max difference in angle allowed, when removing keys',
+    default = 0.00175, min = 0, subtype = 'ANGLE'
+)
+bpy.types.World.scalingTolerance = bpy.props.FloatProperty(
+    name='Scaling Tolerance',
+    description='Max difference in scale allowed, when removing keys',
+    default = 0.001, min = 0, precision = 4
+)
+bpy.types.World.boneAnimationTRS = bpy.props.BoolProperty(
+    name='Bone TRS Animation',
+    description='Export bone keys as position, rotationQuaternion, & scaling animations of a transform node for\neach bone, linked by the bone\'s linkedTransformNodeId, instead of matrices.  Tracks which never move are not\nwritten.  Play them on the transform nodes, which have the ranges of the skeleton',
+    default = False,
+)
+bpy.types.World.bonePositionPrecision = bpy.props.IntProperty(
+    name='Bone Position:',
+    description='Max number of digits for bone position keys',
+    default = 4, min = 0, max = 5
+)
+bpy.types.World.boneRotationPrecision = bpy.props.IntProperty(
+    name='Bone Rotation:',
+    description='Max number of digits for bone rotation quaternion keys',
+    default = 4, min = 0, max = 5
+)
+bpy.types.World.boneScalingPrecision = bpy.props.IntProperty(
+    name='Bone Scaling:',
+    description='Max number of digits for bone scaling keys',
+    default = 3, min = 0, max = 5
+)
 bpy.types.World.ignoreIKBones = bpy.props.BoolProperty(
     name='Ignore IK Bones',
     description="Do not export bones with either '.ik' or 'ik.'(not case sensitive) in the name",
@@ -235,12 +331,28 @@ class WorldPanel(bpy.types.Panel):
         box.prop(world, 'vColorsPrecision')
         box.prop(world, 'mWeightsPrecision')
 
+        box = layout.box()
+        box.label(text='Meshes:')
+        box.prop(world, 'spillMeshes')
+        box.prop(world, 'triangulation')
+
         box = layout.box()
         box.label(text='Textures / Materials:')
         box.prop(world, 'inlineTextures')
         row = box.row()
         row.enabled = not world.inlineTextures
         row.prop(world, 'textureDir')
+        box.prop(world, 'maxTextureSize')
+        row = box.row()
+        row.prop(world, 'powerOfTwoTextures')
+        sub = row.row()
+        sub.enabled = not world.inlineTextures
+        sub.prop(world, 'textureVariants')
+        row = box.row()
+        row.prop(world, 'opaquePNGFormat')
+        sub = row.row()
+        sub.enabled = world.opaquePNGFormat != 'PNG'
+        sub.prop(world, 'reencodeQuality')
         box.prop(world, 'usePBRMaterials')
 
         box = layout.box()
@@ -254,5 +366,18 @@ class WorldPanel(bpy.types.Panel):
         box.prop(world, 'currentActionOnly')
         box.prop(world, 'autoAnimate')
         box.prop(world, 'ignoreIKBones')
+        box.prop(world, 'reduceKeyframes')
+        col = box.column()
+        col.enabled = world.reduceKeyframes
+        col.prop(world, 'positionTolerance')
+        col.prop(world, 'rotationTolerance')
+        col.prop(world, 'scalingTolerance')
+        col.prop(world, 'reduceBoneMatrices')
+        box.prop(world, 'boneAnimationTRS')
+        col = box.column()
+        col.enabled = world.boneAnimationTRS
+        col.prop(world, 'bonePositionPrecision')
+        col.prop(world, 'boneRotationPrecision')
+        col.prop(world, 'boneScalingPrecision')
 
         layout.prop(scene, 'writeManifestFile')
\ No newline at end of file